@@ -1,3 +1,17 @@
 #!/usr/bin/env bash
 
-uvicorn --host 0.0.0.0 --port 6380 --workers 1 src.server:APP --root-path /
\ No newline at end of file
+WORKERS=${WORKERS:-1}
+
+# With several workers (or when PREDICATE_SNAPSHOT_DIR is set), build the versioned predicate snapshot once
+# before forking so that every worker loads it in one step and maps the same read-only index.
+if [ "$WORKERS" -gt 1 ] || [ -n "$PREDICATE_SNAPSHOT_DIR" ]; then
+  export PREDICATE_SNAPSHOT_DIR=${PREDICATE_SNAPSHOT_DIR:-data/predicate_snapshot}
+  # Rebuild when the snapshot is missing or its input files changed, then verify it once here; the workers
+  # load it without reading every file
+  if ! python -m src.snapshot -o "$PREDICATE_SNAPSHOT_DIR" --check; then
+    python -m src.snapshot -o "$PREDICATE_SNAPSHOT_DIR" || exit 1
+  fi
+  python -m src.snapshot -o "$PREDICATE_SNAPSHOT_DIR" --verify || exit 1
+fi
+
+uvicorn --host 0.0.0.0 --port 6380 --workers "$WORKERS" src.server:APP --root-path /
@@ -0,0 +1,136 @@
+import heapq
+import asyncio
+import itertools
+import contextvars
+from enum import Enum
+from contextlib import asynccontextmanager
+
+
+class Priority(str, Enum):
+    interactive = "interactive"
+    bulk = "bulk"
+
+
+PRIORITY_RANK = {Priority.interactive: 0, Priority.bulk: 1}
+
+# Priority class of the request being served; tasks started for the request inherit it
+PRIORITY = contextvars.ContextVar("priority", default=Priority.interactive)
+
+
+class Overloaded(Exception):
+    def __init__(self, status_code, detail, retry_after=None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class PrioritySemaphore:
+    """
+    Semaphore that hands free slots to waiting interactive callers before bulk ones (first come, first served
+    within a class). The class is read from PRIORITY unless given.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.waiters = []
+        self.counter = itertools.count()
+        self.stats = {"acquired": 0, "waited": 0}
+
+    async def acquire(self, priority=None):
+        priority = Priority(priority or PRIORITY.get())
+        self.stats["acquired"] += 1
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+        self.stats["waited"] += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (PRIORITY_RANK[priority], next(self.counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just before the cancellation; pass it on
+                self.release()
+            raise
+
+    def release(self):
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                # The slot moves to the waiter, so the active count stays the same
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority=None):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def state(self):
+        return {"limit": self.limit, "active": self.active,
+                "waiting": sum(not future.done() for _, _, future in self.waiters), **self.stats}
+
+
+class Admission:
+    """
+    Capacity reserved for one request. Inside the with block the request runs under its priority class; the
+    capacity is released when the block exits.
+    """
+    def __init__(self, controller, triples, priority):
+        self.controller = controller
+        self.triples = triples
+        self.priority = priority
+        self.token = None
+
+    def __enter__(self):
+        self.token = PRIORITY.set(self.priority)
+        return self
+
+    def __exit__(self, *exc):
+        PRIORITY.reset(self.token)
+        self.controller.inflight[self.priority] -= self.triples
+
+
+class AdmissionController:
+    """
+    Limits the triples a worker works on at once. Requests over max_request_triples are refused outright (413).
+    Bulk requests may only use bulk_share of the in-flight capacity, which keeps headroom for interactive
+    requests; a bulk request over its share gets 429 and any request over the total gets 503, both with a
+    Retry-After. A limit of 0 disables it. A request is always admitted when nothing else is in flight.
+    """
+    def __init__(self, max_inflight_triples=0, max_request_triples=0, bulk_share=0.5, retry_after=1):
+        self.max_inflight_triples = max_inflight_triples
+        self.max_request_triples = max_request_triples
+        self.bulk_share = bulk_share
+        self.retry_after = retry_after
+        self.inflight = {priority: 0 for priority in Priority}
+        self.stats = {"admitted": 0, "too_large": 0, "throttled": 0, "unavailable": 0}
+
+    def admit(self, triples, priority) -> Admission:
+        """ Reserve capacity for a request or raise Overloaded. """
+        priority = Priority(priority)
+        if self.max_request_triples and triples > self.max_request_triples:
+            self.stats["too_large"] += 1
+            raise Overloaded(413, f"{triples} triples is over the limit of {self.max_request_triples} per request")
+        total = sum(self.inflight.values())
+        if self.max_inflight_triples and total > 0:
+            if priority == Priority.bulk and \
+                    self.inflight[priority] + triples > self.bulk_share * self.max_inflight_triples:
+                self.stats["throttled"] += 1
+                raise Overloaded(429, "Bulk capacity is in use; retry later", self.retry_after)
+            if total + triples > self.max_inflight_triples:
+                self.stats["unavailable"] += 1
+                raise Overloaded(503, "Server is at capacity; retry later", self.retry_after)
+        self.stats["admitted"] += 1
+        self.inflight[priority] += triples
+        return Admission(self, triples, priority)
+
+    def state(self):
+        return {"max_inflight_triples": self.max_inflight_triples, "max_request_triples": self.max_request_triples,
+                "inflight_triples": {priority.value: count for priority, count in self.inflight.items()},
+                **self.stats}
@@ -2,9 +2,11 @@ import re
 import json
 import ast
 import asyncio
+import numpy as np
 import requests
 import yaml
-from collections import defaultdict
+from collections import defaultdict, Counter
+from functools import lru_cache
 from typing import Union
 from src.llm_client import HEALpacaAsyncClient
 import logging
@@ -12,9 +14,46 @@ logger = logging.getLogger(__name__)
 logging.getLogger("linkml_runtime").setLevel(logging.WARNING)
 logging.getLogger("docarray").setLevel(logging.ERROR)
 from bmt import Toolkit
-from src.predicate_database import PredicateDatabase
+from src.predicate_database import PredicateDatabase, normalize_text
+from src.executor import CPUExecutor, chunks
+from src.records import Candidates, TripleRecord, embedding_block
 
-t = Toolkit()
+# How each rerank response was turned into a predicate: "structured" (schema-constrained JSON),
+# "regex" (extract_mapped_predicate), "fallback" (nothing parsed, the top vector candidate is used) or
+# "deadline" (not reranked within the latency budget, the top vector candidate is used)
+RERANK_PARSE_COUNTS = Counter()
+# Relationships that needed an embedding: "hit" when a predicate text matched lexically and its stored vector
+# was used instead of calling the embedding backend, otherwise "miss"
+LEXICAL_SHORTCUT_COUNTS = Counter()
+DEADLINE_SELECTOR_SUFFIX = ":deadline"
+
+
+@lru_cache(maxsize=1)
+def get_toolkit():
+    """ Biolink Toolkit, loaded on first use so processes serving a prebuilt index never load it. """
+    return Toolkit()
+
+
+def get_inverse(predicate, db):
+    if db.inverses is not None:
+        return db.inverses.get(predicate)
+    try:
+        return get_toolkit().get_element(predicate).inverse
+    except AttributeError:
+        return None
+
+
+def compute_inverses(predicates):
+    """ Inverse table for the predicate names that process_single_edge expands, as stored with a saved index. """
+    inverses = {}
+    for predicate in sorted({p.replace("biolink:", "").replace("_NEG", "") for p in predicates}):
+        try:
+            inverse = get_toolkit().get_element(predicate).inverse
+        except AttributeError:
+            continue
+        if inverse is not None:
+            inverses[predicate] = inverse
+    return inverses
 
 def get_prompt(subject, object, relationship, abstract, predicate_choices, **kwargs):
     relationship_system_prompt = f"""
@@ -71,46 +110,125 @@ class PredicateClient(HEALpacaAsyncClient):
     def __init__( self, **kwargs ):
         super().__init__(**kwargs)
         self.qualified_predicates = None
-
-    async def check_relationship(self, relationships_json: list[dict], qualified_predicates: dict, is_vdb = False, is_nn= False) -> list:
-        """ Send options for a single relationship to LLM """
+        # Free-text answers longer than parse_offload_chars are parsed on the executor, if there is one
+        self.executor = None
+        self.parse_offload_chars = 2000
+
+    async def check_relationship(self, relationships_json: list[dict], qualified_predicates: dict, is_vdb = False, is_nn= False,
+                                 structured=False, deadline=None) -> list:
+        """
+        Send options for a single relationship to LLM. With a deadline (event loop time), calls still running at
+        the deadline are cancelled and their triples keep the top vector candidate.
+        """
+        self.qualified_predicates = qualified_predicates
+        requests = [(relationship_json.get("relationship"), get_prompt(**relationship_json),
+                     relationship_json.get("predicate_choices")) for relationship_json in relationships_json]
+        top_choices = await self._rerank(requests, is_vdb, is_nn, structured, deadline)
+        for relationship_json, top_choice in zip(relationships_json, top_choices):
+            relationship_json["top_choice"] = top_choice
+            relationship_json.pop("predicate_choices", None)
+        return relationships_json
+
+    async def check_records(self, all_records: list[TripleRecord], qualified_predicates: dict, descriptions: dict,
+                            is_vdb=False, is_nn=False, structured=False, deadline=None) -> list[TripleRecord]:
+        """
+        check_relationship for TripleRecords; the predicate choices of a prompt are built from its candidate ids.
+        Records that have an error or no candidates keep their place without a top choice.
+        """
         self.qualified_predicates = qualified_predicates
-        tasks = []
-        for relationship_json in relationships_json:
-            prompt = get_prompt(**relationship_json)
-            task = asyncio.create_task(self._process_single_relationship(relationship_json, prompt, is_vdb, is_nn))
-            tasks.append(task)
-        return await asyncio.gather(*tasks)
-
-    async def _process_single_relationship(self, relationship_json, prompt, is_vdb, is_nn):
-        ai_response = await self.get_chat_completion(prompt)
-        return self._format_relationship_result(relationship_json, ai_response, is_vdb, is_nn)
-
-    def _format_relationship_result( self, relationship_json, ai_response, is_vdb, is_nn ):
-        choices = list(relationship_json.get("predicate_choices").keys())
-        top_choice = extract_mapped_predicate(ai_response, relationship_json.get("predicate_choices"))
+        for record in all_records:
+            if record.error is None and record.candidates is None:
+                record.error = "No predicate candidates for the relationship"
+        records = [record for record in all_records if record.error is None]
+        requests = []
+        for record in records:
+            choices = {name: descriptions.get(name, name) for name in record.candidate_names()}
+            prompt = get_prompt(record.subject, record.object, record.relationship, record.abstract, choices)
+            requests.append((record.relationship, prompt, choices))
+        top_choices = await self._rerank(requests, is_vdb, is_nn, structured, deadline)
+        for record, top_choice in zip(records, top_choices):
+            record.top_choice = top_choice
+        return all_records
+
+    async def _rerank(self, requests, is_vdb, is_nn, structured, deadline):
+        """ Top choice of each (relationship, prompt, predicate_choices) request. """
+        tasks = [asyncio.create_task(self._process_single_relationship(relationship, prompt, choices, is_vdb, is_nn,
+                                                                       structured))
+                 for relationship, prompt, choices in requests]
+        if deadline is None or not tasks:
+            return await asyncio.gather(*tasks)
+
+        await asyncio.wait(tasks, timeout=max(deadline - asyncio.get_running_loop().time(), 0))
+        results = []
+        for (_, _, choices), task in zip(requests, tasks):
+            if task.done():
+                results.append(task.result())
+            else:
+                task.cancel()
+                results.append(self._deadline_result(choices, is_vdb, is_nn))
+        return results
+
+    async def _process_single_relationship(self, relationship, prompt, choices, is_vdb, is_nn, structured=False):
+        schema = rerank_schema(choices) if structured else None
+        async with self.rerank_slot():
+            if self.stream:
+                ai_response = await self.get_streamed_chat_completion(prompt, format=schema, stop_key="mapped_predicate")
+            elif structured:
+                ai_response = await self.get_structured_chat_completion(prompt, schema)
+            else:
+                ai_response = await self.get_chat_completion(prompt)
+        regex_choice = None
+        if self.executor is not None and not structured and isinstance(ai_response, str) \
+                and len(ai_response) > self.parse_offload_chars:
+            regex_choice = await self.executor.run_pure(extract_mapped_predicate, ai_response, choices)
+        return self._format_relationship_result(relationship, choices, ai_response, is_vdb, is_nn, structured,
+                                                regex_choice)
+
+    def _format_relationship_result( self, relationship, choices, ai_response, is_vdb, is_nn, structured=False,
+                                     regex_choice=None ):
+        top_choice = None
+        if structured:
+            top_choice = parse_structured_response(ai_response, build_choice_index(choices))
+        if top_choice is not None:
+            RERANK_PARSE_COUNTS["structured"] += 1
+        else:
+            if regex_choice is None:
+                regex_choice = extract_mapped_predicate(ai_response, choices)
+            top_choice = regex_choice or {}
+            RERANK_PARSE_COUNTS["regex" if top_choice.get("mapped_predicate") else "fallback"] += 1
         logger.info(f"""
         [LLM]: {self.chat_model}
-        [Input]: {relationship_json.get('relationship')}
+        [Input]: {relationship}
         [LLM Raw Response]: {ai_response}
         [Parsed Predicate]: {top_choice}
         """)
+        keys = list(choices)
         if not top_choice:
             logger.warning(
-                f"No valid mapping for relationship: {relationship_json.get('relationship')}. Falling back to: {choices[0]}")
-        negated = top_choice.get("negated", False)
+                f"No valid mapping for relationship: {relationship}. Falling back to: {keys[0]}")
+        negated = str(top_choice.get("negated", False)).lower() == "true"
         top_choice = top_choice.get("mapped_predicate", None)
-        predicate = top_choice or f'biolink:{choices[0].replace(" ", "_")}'
+        predicate = top_choice or f'biolink:{keys[0].replace(" ", "_")}'
         predicate, oaq, odq = self.is_qualified(predicate)
-        relationship_json["top_choice"] = {
+        return {
             "predicate": predicate,
             "object_aspect_qualifier": oaq,
             "object_direction_qualifier": odq,
             "negated": negated,
-            "selector":  self.chat_model if top_choice else "vectorDB" if is_vdb else "nearest_neighbors" if is_nn else "similarities"
+            "selector":  self.chat_model if top_choice else retrieval_selector(is_vdb, is_nn)
+        }
+
+    def _deadline_result(self, choices, is_vdb, is_nn):
+        """ Top vector candidate for a triple whose rerank did not finish within the latency budget. """
+        RERANK_PARSE_COUNTS["deadline"] += 1
+        predicate, oaq, odq = self.is_qualified(f'biolink:{list(choices)[0].replace(" ", "_")}')
+        return {
+            "predicate": predicate,
+            "object_aspect_qualifier": oaq,
+            "object_direction_qualifier": odq,
+            "negated": False,
+            "selector": retrieval_selector(is_vdb, is_nn) + DEADLINE_SELECTOR_SUFFIX
         }
-        relationship_json.pop("predicate_choices", None)
-        return relationship_json
 
     def is_qualified(self, predicate):
         p = self.qualified_predicates.get(predicate, None)
@@ -120,6 +238,15 @@ class PredicateClient(HEALpacaAsyncClient):
         return p.get("predicate", ""), p.get("object_aspect_qualifier", ""), p.get("object_direction_qualifier", "")
 
 
+def retrieval_selector(is_vdb, is_nn):
+    return "vectorDB" if is_vdb else "nearest_neighbors" if is_nn else "similarities"
+
+
+def retrieval_method(is_vdb, is_nn):
+    """ Top_n_retrieval_method of the results. """
+    return "vectorDb" if is_vdb else ("nearest_neighbors" if is_nn else "similarities")
+
+
 def parse_new_llm_response(llm_response: Union[str, list[dict]]) -> list[dict]:
     if isinstance(llm_response, str):
         with open(llm_response, "r") as f:
@@ -146,7 +273,7 @@ def relationship_queries_to_batch(query_results: list[dict], descriptions, is_vd
         "relationship",
         "abstract",
     ]
-    method = "vectorDb" if is_vdb else ("nearest_neighbors" if is_nn else "similarities")
+    method = retrieval_method(is_vdb, is_nn)
     for edge in query_results:
         batch_edge = {key: val for key, val in edge.items() if key in batch_keys}
         batch_edge["Top_n_retrieval_method"] = method
@@ -159,11 +286,10 @@ def relationship_queries_to_batch(query_results: list[dict], descriptions, is_vd
 
 
 async def lookup_unique_predicates(parsed_data: list[dict], db: PredicateDatabase, output_file: str = None,
-                              num_results: int = 10) -> list[dict]:
+                              num_results: int = 10, executor: CPUExecutor = None, chunk_size: int = 256) -> list[dict]:
     print("Looking up mapped predicates for all relationships")
 
-    tasks = [process_single_edge(edge, db, num_results) for edge in parsed_data]
-    updated_data = await asyncio.gather(*tasks)
+    updated_data = await process_edges(parsed_data, db, num_results, executor, chunk_size)
 
     need_embeddings = sum(["relationship_embedding" in list(edge.keys()) for edge in parsed_data])
     print(f"Embeddings found: {need_embeddings}. Sending {len(parsed_data) - need_embeddings} relationships to model.")
@@ -175,40 +301,194 @@ async def lookup_unique_predicates(parsed_data: list[dict], db: PredicateDatabas
     return updated_data
 
 
-async def process_single_edge( edge, db, num_results ):
-    try:
-        if "relationship_embedding" not in edge:
-            edge["relationship_embedding"] = await db.client.get_embedding(edge["relationship"])
-
-        search_results = await db.search(
-            text=edge["relationship"],
-            embedding=edge["relationship_embedding"],
-            num_results=num_results
-        )
-
-        if search_results:
-            unique_predicates = {
-                search_results[key]["mapped_predicate"].replace("biolink:", "").replace("_NEG", ""):
-                    round(search_results[key]["score"], 5)
-                for key in search_results
-            }
-
-            for predicate in unique_predicates.copy():
-                try:
-                    if t.get_element(predicate).inverse is not None:
-                        unique_predicates[t.get_element(predicate).inverse] = unique_predicates[predicate]
-                except AttributeError:
-                    pass
+async def process_single_edge( edge, db, num_results, executor=None ):
+    return (await process_edges([edge], db, num_results, executor))[0]
+
+
+async def process_edges(edges, db, num_results, executor=None, chunk_size=256):
+    """ lookup_records for edge dicts: fills in relationship_embedding (a list) and Top_n_candidates (a dict). """
+    records = records_from_edges(edges)
+    block = await lookup_records(records, db, num_results, executor, chunk_size,
+                                 embeddings=[edge.get("relationship_embedding") for edge in edges])
+    for edge, record in zip(edges, records):
+        if record.error is not None:
+            continue
+        # Cached candidates need no embedding, so their edges do not get one
+        if "relationship_embedding" not in edge and (record.row >= 0 or record.candidates is None):
+            edge["relationship_embedding"] = block[record.row].tolist() if record.row >= 0 else None
+        if record.candidates is not None:
+            edge["Top_n_candidates"] = record.candidates.as_dict()
+    return edges
+
+
+def records_from_edges(edges) -> list[TripleRecord]:
+    """ One record per edge, in order; an edge without a relationship gets an error record that is not looked up. """
+    records = [TripleRecord.from_edge(edge) for edge in edges]
+    for edge, record in zip(edges, records):
+        if record.error is not None:
+            logger.warning(f"{record.error}: {json.dumps(edge)[:500]}")
+    return records
+
 
-            edge["Top_n_candidates"] = {
-                predicate.replace("_", " "): score
-                for predicate, score in sorted(unique_predicates.items(), key=lambda item: item[1], reverse=True)
-            }
+LOOKUP_DEADLINE_ERROR = "Latency budget spent before the vector search"
+EMBEDDING_ERROR = "No embedding returned for the relationship"
 
-    except KeyError as e:
-        print(f"KeyError: {e}\n{json.dumps(edge, indent=2)}")
 
-    return edge
+async def lookup_records(records, db, num_results=10, executor=None, chunk_size=256, embeddings=None,
+                         deadline=None) -> np.ndarray:
+    """
+    Fill in the candidates of each record: cached candidates first, then the embeddings the records are missing
+    (given in `embeddings`, the stored vector of a lexically matching predicate text, else concurrent embedding
+    calls), then search and candidate expansion in chunks, each chunk one call on the executor. The embeddings
+    are gathered in one float32 block for the request, which is returned; record.row is the row of each.
+    With a deadline (event loop time), embedding calls still running at the deadline are cancelled and their
+    records get LOOKUP_DEADLINE_ERROR, keeping their place without candidates. Records already embedded are still
+    searched, since the local search is short and a rerank cut by the deadline falls back to their top candidate.
+    Records whose embedding call failed get EMBEDDING_ERROR.
+    """
+    embeddings = embeddings or [None] * len(records)
+    pending = []
+    for record, embedding in zip(records, embeddings):
+        if record.error is not None:
+            continue
+        # Candidates only depend on the text while the index is unchanged; a caller-supplied embedding bypasses the cache
+        cache_key = None
+        if db.candidate_cache is not None and embedding is None:
+            cache_key = (record.relationship, num_results, db.generation)
+            candidates = db.candidate_cache.get(cache_key)
+            if candidates is not None:
+                record.candidates = candidates
+                continue
+        pending.append([record, cache_key, embedding])
+
+    missing = []
+    for item in pending:
+        record, _, embedding = item
+        if embedding is not None:
+            continue
+        if db.lexical_shortcut:
+            vector = db.lexical_vector(record.relationship)
+            LEXICAL_SHORTCUT_COUNTS["miss" if vector is None else "hit"] += 1
+            if vector is not None:
+                item[2] = vector
+                continue
+        missing.append(item)
+    fetched, cut_off = await embed_until([record.relationship for record, _, _ in missing], db.client, deadline)
+    for item, embedding, late in zip(missing, fetched, cut_off):
+        if late:
+            item[0].error = LOOKUP_DEADLINE_ERROR
+        elif embedding is None or len(embedding) == 0:
+            item[0].error = EMBEDDING_ERROR
+        item[2] = embedding
+
+    searchable = [item for item in pending if item[2] is not None and len(item[2]) > 0]
+    block = embedding_block([embedding for _, _, embedding in searchable])
+    for row, (record, _, _) in enumerate(searchable):
+        record.row = row
+    for chunk, rows in zip(chunks(searchable, chunk_size), chunks(block, chunk_size)):
+        texts = [record.relationship for record, _, _ in chunk]
+        if executor is not None:
+            candidates = await executor.run(search_candidates, db, texts, rows, num_results)
+        else:
+            candidates = search_candidates(db, texts, rows, num_results)
+        for (record, cache_key, _), record_candidates in zip(chunk, candidates):
+            if record_candidates:
+                record.candidates = record_candidates
+                if cache_key is not None:
+                    db.candidate_cache.put(cache_key, record_candidates)
+    return block
+
+
+async def embed_until(texts, client, deadline=None) -> tuple[list, list]:
+    """
+    Concurrent embeddings of texts, and for each whether it was cut off: with a deadline, calls still running
+    then are cancelled and give None. A failed call gives None without being cut off.
+    """
+    tasks = [asyncio.create_task(client.get_embedding(text)) for text in texts]
+    if deadline is None or not tasks:
+        return await asyncio.gather(*tasks), [False] * len(tasks)
+
+    await asyncio.wait(tasks, timeout=max(deadline - asyncio.get_running_loop().time(), 0))
+    cut_off = [not task.done() for task in tasks]
+    embeddings = [None if late else task.result() for task, late in zip(tasks, cut_off)]
+    for task in tasks:
+        task.cancel()
+    return embeddings, cut_off
+
+
+def search_candidates(db, texts, embeddings, num_results):
+    """ Search a chunk of embedded relationships and expand the results; CPU-bound, run off the event loop. """
+    return [Candidates.from_ranked(rank_candidates(results, db)) if results else None
+            for results in db.search_batch(texts, embeddings, num_results)]
+
+
+def rank_candidates(search_results, db):
+    """
+    Rerank candidates from search results: predicate names without the biolink prefix or _NEG suffix, plus the
+    inverse of each, ranked by score; (name, score) pairs.
+    """
+    unique_predicates = {
+        search_results[key]["mapped_predicate"].replace("biolink:", "").replace("_NEG", ""):
+            round(search_results[key]["score"], 5)
+        for key in search_results
+    }
+
+    for predicate in unique_predicates.copy():
+        inverse = get_inverse(predicate, db)
+        if inverse is not None:
+            unique_predicates[inverse] = unique_predicates[predicate]
+
+    return [
+        (predicate.replace("_", " "), score)
+        for predicate, score in sorted(unique_predicates.items(), key=lambda item: item[1], reverse=True)
+    ]
+
+
+def build_choice_index(choices):
+    """ Normalized predicate key or description -> canonical key, so a parsed answer resolves with one lookup. """
+    index = {}
+    for key, description in choices.items():
+        if isinstance(description, str):
+            index.setdefault(normalize_text(description), key)
+    for key in choices:
+        index[normalize_text(key)] = key
+    return index
+
+
+def rerank_schema(choices):
+    """ JSON schema restricting the rerank answer to one of the candidate keys or "none". """
+    return {
+        "type": "object",
+        "properties": {
+            "mapped_predicate": {"type": "string", "enum": [*choices.keys(), "none"]},
+            "negated": {"type": "string", "enum": ["True", "False"]},
+        },
+        "required": ["mapped_predicate", "negated"],
+    }
+
+
+def parse_structured_response(response_text, choice_index):
+    """
+    Fast path for schema-constrained answers. Returns None when the response is not the expected object so
+    the caller can fall back to extract_mapped_predicate.
+    """
+    if not isinstance(response_text, str):
+        return None
+    try:
+        parsed = json.loads(response_text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("mapped_predicate"), str):
+        return None
+
+    negated = str(parsed.get("negated", "False")).capitalize()
+    mapped = normalize_text(parsed["mapped_predicate"])
+    if mapped == "none":
+        return {"mapped_predicate": None, "negated": "False"}
+    key = choice_index.get(mapped)
+    if key is None:
+        return None
+    return {"mapped_predicate": f'biolink:{key.replace(" ", "_")}', "negated": negated}
 
 
 def extract_mapped_predicate(response_text, choices):
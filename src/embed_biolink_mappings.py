@@ -0,0 +1,120 @@
+import json
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+from src.llm_client import HEALpacaAsyncClient
+
+logger = logging.getLogger(__name__)
+
+
+def collect_predicate_texts(description_file, qualified_predicate_file=None, mappings_file=None, lowercase=False):
+    """
+    Predicate/text pairs to embed: every described predicate under its own name, every qualified predicate
+    and, if given, the phrasings of a mappings file ({"predicate": ["text", ...]}).
+    """
+    def to_predicate(name):
+        return name if name.startswith("biolink:") else f'biolink:{name.replace(" ", "_")}'
+
+    def to_text(name):
+        text = name.replace("biolink:", "").replace("_", " ")
+        return text.lower() if lowercase else text
+
+    pairs = []
+    with open(description_file, "r") as f:
+        pairs.extend((to_predicate(key), to_text(key)) for key in json.load(f))
+    if qualified_predicate_file is not None:
+        with open(qualified_predicate_file, "r") as f:
+            pairs.extend((to_predicate(key), to_text(key)) for key in json.load(f))
+    if mappings_file is not None:
+        with open(mappings_file, "r") as f:
+            for predicate, texts in json.load(f).items():
+                pairs.extend((to_predicate(predicate), to_text(text)) for text in texts)
+
+    # Keep the first occurrence of every pair
+    return [{"predicate": p, "text": t} for p, t in dict.fromkeys(pair for pair in pairs if pair[1])]
+
+
+class EmbeddingCache:
+    """ Append-only JSONL checkpoint of computed embeddings, so an interrupted build resumes where it stopped. """
+    def __init__(self, path, model):
+        self.path = Path(path)
+        self.model = model
+        self.embeddings = {}
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line of a build that was killed mid-write
+                        continue
+                    if record.get("model") == model:
+                        self.embeddings[record["text"]] = record["embedding"]
+
+    def __contains__(self, text):
+        return text in self.embeddings
+
+    def add(self, texts, embeddings):
+        with open(self.path, "a") as f:
+            for text, embedding in zip(texts, embeddings):
+                self.embeddings[text] = embedding
+                f.write(json.dumps({"model": self.model, "text": text, "embedding": embedding}) + "\n")
+
+
+async def embed_texts(client, texts, cache, batch_size=64, concurrency=4, retries=3):
+    """ Embed the texts missing from the cache with batched, concurrency-limited calls. """
+    missing = list(dict.fromkeys(text for text in texts if text not in cache))
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+    logger.info(f"{len(texts) - len(missing)} texts cached, embedding {len(missing)} in {len(batches)} batches")
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = []
+
+    async def embed_batch(batch):
+        async with semaphore:
+            for attempt in range(retries):
+                embeddings = await client.get_batch_embeddings(batch)
+                if embeddings is not None:
+                    cache.add(batch, embeddings)
+                    return
+                await asyncio.sleep(2 ** attempt)
+            failed.extend(batch)
+
+    await asyncio.gather(*(embed_batch(batch) for batch in batches))
+    if failed:
+        raise RuntimeError(f"Could not embed {len(failed)} texts; rerun to resume from {cache.path}")
+
+
+async def build_vectors(client, entries, output_file, cache_file=None, batch_size=64, concurrency=4, retries=3):
+    """ Embed the predicate texts and write them in the format the server loads. """
+    cache = EmbeddingCache(cache_file or f"{output_file}.cache.jsonl", client.embedding_model)
+    await embed_texts(client, [entry["text"] for entry in entries], cache, batch_size, concurrency, retries)
+    vectors = [{**entry, "embedding": cache.embeddings[entry["text"]]} for entry in entries]
+    with open(output_file, "w") as f:
+        json.dump(vectors, f)
+    logger.info(f"Wrote {len(vectors)} predicate vectors to {output_file}")
+    return vectors
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Embed the predicate texts into the vectors file loaded by the server")
+    parser.add_argument("-d", "--description_file", default="data/short_description.json")
+    parser.add_argument("-q", "--qualified_predicate_file", default="data/qualified_predicate_mapping.json")
+    parser.add_argument("-m", "--mappings_file", default=None, help="JSON of predicate -> list of phrasings")
+    parser.add_argument("-e", "--embeddings_file", default="data/all_biolink_mapped_vectors.json")
+    parser.add_argument("-c", "--cache_file", default=None, help="Checkpoint of computed embeddings")
+    parser.add_argument("--embedding_model", default="nomic-embed-text")
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--lowercase", action="store_true")
+    parser.add_argument("--snapshot_dir", default=None, help="Also build a server snapshot from the result")
+    args = parser.parse_args()
+
+    predicate_texts = collect_predicate_texts(args.description_file, args.qualified_predicate_file,
+                                              args.mappings_file, args.lowercase)
+    asyncio.run(build_vectors(HEALpacaAsyncClient(embedding_model=args.embedding_model), predicate_texts,
+                              args.embeddings_file, args.cache_file, args.batch_size, args.concurrency))
+    if args.snapshot_dir is not None:
+        from src.snapshot import build_snapshot
+        build_snapshot(args.embeddings_file, args.description_file, args.qualified_predicate_file, args.snapshot_dir)
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """
+    Collects embedding requests from all concurrent callers for up to `max_wait` seconds (or until
+    `max_batch_size` distinct texts are waiting) and sends them as one batched call. Identical texts in a
+    window share one embedding. If the batched call fails, each text falls back to its own call.
+    """
+    def __init__(self, embed_batch, embed_one, max_wait=0.005, max_batch_size=64):
+        self.embed_batch = embed_batch
+        self.embed_one = embed_one
+        self.max_wait = max_wait
+        self.max_batch_size = max_batch_size
+        self.pending = {}
+        self.timer = None
+        # The loop only keeps weak references to tasks; an unreferenced flush could be collected mid-flight
+        self.tasks = set()
+        self.stats = {"requests": 0, "texts": 0, "batches": 0, "fallbacks": 0, "largest_batch": 0}
+
+    async def embed(self, text):
+        self.stats["requests"] += 1
+        future = self.pending.get(text)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self.pending[text] = future
+            if len(self.pending) >= self.max_batch_size:
+                self._flush()
+            elif self.timer is None:
+                self.timer = loop.call_later(self.max_wait, self._flush)
+        # A cancelled caller must not cancel the embedding shared with the rest of the batch
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, {}
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def close(self, timeout=None):
+        """ Send what is waiting and wait for the batches in flight; any still running after timeout are cancelled. """
+        self._flush()
+        if not self.tasks:
+            return
+        _, running = await asyncio.wait(set(self.tasks), timeout=timeout)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    async def _send(self, batch):
+        texts = list(batch)
+        self.stats["texts"] += len(texts)
+        self.stats["batches"] += 1
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(texts))
+        try:
+            embeddings = await self.embed_batch(texts)
+            if embeddings is None:
+                self.stats["fallbacks"] += 1
+                embeddings = await asyncio.gather(*(self.embed_one(text) for text in texts))
+        except Exception as e:
+            logger.exception("Embedding batch failed")
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except asyncio.CancelledError:
+            # Not an Exception: without this, callers waiting on a cancelled batch would never be woken
+            for future in batch.values():
+                future.cancel()
+            raise
+        for text, embedding in zip(texts, embeddings):
+            if not batch[text].done():
+                batch[text].set_result(embedding)
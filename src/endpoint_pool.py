@@ -0,0 +1,123 @@
+import time
+import itertools
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+
+def parse_endpoints(spec) -> list:
+    """ "http://a:11434,http://b:11434|2" -> [("http://a:11434", 1.0), ("http://b:11434", 2.0)] """
+    endpoints = []
+    for item in spec.split(","):
+        url, _, weight = item.strip().partition("|")
+        if url:
+            endpoints.append((url.rstrip("/"), float(weight) if weight else 1.0))
+    return endpoints
+
+
+class Endpoint:
+    def __init__(self, base_url, weight=1.0):
+        self.base_url = base_url.rstrip("/")
+        self.weight = weight
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.stats = {"requests": 0, "errors": 0, "slow": 0, "total_latency": 0.0}
+        self.ewma_latency = None
+        self.last_error = None
+
+    def url_for(self, url):
+        """ The same API path as `url`, on this endpoint. """
+        parts = urlsplit(url)
+        return self.base_url + parts.path + (f"?{parts.query}" if parts.query else "")
+
+    def state(self, now):
+        requests = self.stats["requests"]
+        return {
+            "url": self.base_url,
+            "weight": self.weight,
+            "outstanding": self.outstanding,
+            "ejected": self.ejected_until > now,
+            "ejections": self.ejections,
+            "requests": requests,
+            "errors": self.stats["errors"],
+            "slow": self.stats["slow"],
+            "mean_latency_ms": round(1000 * self.stats["total_latency"] / requests, 1) if requests else None,
+            "ewma_latency_ms": round(1000 * self.ewma_latency, 1) if self.ewma_latency is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class EndpointPool:
+    """
+    Ollama-compatible backends serving the same models. Calls go to the endpoint with the fewest outstanding
+    requests per unit of weight. An endpoint that fails (or answers slower than slow_seconds) max_failures
+    times in a row is ejected for eject_seconds, doubling with each ejection in a row; when that time is up it
+    is readmitted on probation and the next failure ejects it again.
+    """
+    def __init__(self, endpoints, max_failures=3, eject_seconds=30.0, slow_seconds=0.0, max_attempts=2):
+        self.endpoints = [Endpoint(url, weight) for url, weight in endpoints]
+        if not self.endpoints:
+            raise ValueError("An endpoint pool needs at least one endpoint")
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.slow_seconds = slow_seconds
+        self.max_attempts = max_attempts
+        self.rotation = itertools.count()
+
+    def pick(self, exclude=()) -> Endpoint:
+        now = time.monotonic()
+        # Rotating the start spreads sequential calls between equally loaded endpoints
+        start = next(self.rotation) % len(self.endpoints)
+        candidates = [e for e in self.endpoints[start:] + self.endpoints[:start] if e not in exclude]
+        admitted = [e for e in candidates if e.ejected_until <= now]
+        if not admitted:
+            # Everything is ejected: try the endpoint that is readmitted first rather than fail outright
+            return min(candidates, key=lambda e: e.ejected_until)
+        return min(admitted, key=lambda e: (e.outstanding + 1) / e.weight)
+
+    def attempts(self):
+        """ Endpoints to try for one call: the best one, then others if it fails. """
+        tried = []
+        for _ in range(min(self.max_attempts, len(self.endpoints))):
+            endpoint = self.pick(exclude=tried)
+            tried.append(endpoint)
+            yield endpoint
+
+    @contextmanager
+    def track(self, endpoint):
+        """ Count a call as outstanding while it runs and record its outcome; cancellation records nothing. """
+        endpoint.outstanding += 1
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.record(endpoint, time.monotonic() - start, error=f"{type(e).__name__}: {e}")
+            raise
+        else:
+            self.record(endpoint, time.monotonic() - start)
+        finally:
+            endpoint.outstanding -= 1
+
+    def record(self, endpoint, latency, error=None):
+        endpoint.stats["requests"] += 1
+        endpoint.stats["total_latency"] += latency
+        endpoint.ewma_latency = latency if endpoint.ewma_latency is None else 0.8 * endpoint.ewma_latency + 0.2 * latency
+        slow = self.slow_seconds > 0 and latency > self.slow_seconds
+        if error is not None:
+            endpoint.stats["errors"] += 1
+            endpoint.last_error = error
+        if slow:
+            endpoint.stats["slow"] += 1
+        if error is None and not slow:
+            endpoint.consecutive_failures = 0
+            endpoint.ejections = 0
+            return
+        endpoint.consecutive_failures += 1
+        if endpoint.consecutive_failures >= self.max_failures:
+            endpoint.ejections += 1
+            endpoint.ejected_until = time.monotonic() + self.eject_seconds * 2 ** min(endpoint.ejections - 1, 5)
+
+    def state(self):
+        now = time.monotonic()
+        return [endpoint.state(now) for endpoint in self.endpoints]
@@ -0,0 +1,159 @@
+import json
+import time
+import asyncio
+import logging
+import argparse
+import numpy as np
+from src.predicate_database import PredicateDatabase
+from src.biolink_predicate_lookup import search_candidates, compute_inverses
+
+logger = logging.getLogger(__name__)
+
+
+def build_database(embeddings, **kwargs):
+    db = PredicateDatabase(client=None, **kwargs)
+    db.populate_db(embeddings)
+    return db
+
+
+def load_snapshot_database(snapshot_dir):
+    db = PredicateDatabase(client=None)
+    db.load_index(snapshot_dir, mmap=True)
+    return db
+
+
+# Backend name -> function building a database from the predicate vectors; add new backends here
+BACKENDS = {
+    "similarities": lambda embeddings: build_database(embeddings),
+    "nearest_neighbor": lambda embeddings: build_database(embeddings, is_nn=True),
+    "vectordb": lambda embeddings: build_database(embeddings, is_vdb=True),
+}
+
+
+def candidate_name(predicate):
+    """ A gold predicate in the form of the Top_n_candidates keys. """
+    return predicate.replace("biolink:", "").replace("_NEG", "").replace("_", " ")
+
+
+def load_examples(labeled_file) -> list:
+    """
+    Labeled relationship phrases from a .json list or .jsonl file of {"relationship": ..., "predicate": ...};
+    "predicate" may be a list of acceptable predicates and "embedding" may be given.
+    """
+    with open(labeled_file, "r") as f:
+        records = [json.loads(line) for line in f if line.strip()] if str(labeled_file).endswith(".jsonl") \
+            else json.load(f)
+    examples = []
+    for record in records:
+        gold = record["predicate"] if isinstance(record["predicate"], list) else [record["predicate"]]
+        examples.append({"relationship": record["relationship"], "gold": {candidate_name(p) for p in gold},
+                         "embedding": record.get("embedding")})
+    return examples
+
+
+async def embed_examples(client, examples, cache_file):
+    """ Fill in missing embeddings once, so every backend is searched with the same query vectors. """
+    from src.embed_biolink_mappings import EmbeddingCache, embed_texts
+    cache = EmbeddingCache(cache_file, client.embedding_model)
+    await embed_texts(client, [e["relationship"] for e in examples if e["embedding"] is None], cache)
+    for example in examples:
+        if example["embedding"] is None:
+            example["embedding"] = cache.embeddings[example["relationship"]]
+
+
+def evaluate_database(db, examples, ks=(1, 3, 5, 10), num_results=10) -> dict:
+    """
+    Recall@k of the gold predicates among the expanded candidates, and the latency of search plus expansion.
+    Candidates come from search_candidates, the search and expansion the service runs for each chunk.
+    """
+    hits = {k: 0 for k in ks}
+    latencies = []
+    for example in examples:
+        embedding = np.asarray([example["embedding"]], dtype=np.float32)
+        start = time.perf_counter()
+        candidates = search_candidates(db, [example["relationship"]], embedding, num_results)[0]
+        latencies.append(time.perf_counter() - start)
+        ranked = candidates.names() if candidates is not None else []
+        for k in ks:
+            if example["gold"] & set(ranked[:k]):
+                hits[k] += 1
+    latencies = np.array(latencies) * 1000
+    return {
+        **{f"recall@{k}": hits[k] / len(examples) for k in ks},
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def evaluate_backends(embeddings, examples, backends=None, ks=(1, 3, 5, 10), num_results=10, snapshot_dir=None,
+                      inverses=None) -> list:
+    """ One report row per backend: recall@k, latency, build time and the memory of its index. """
+    builders = {name: BACKENDS[name] for name in (backends or BACKENDS)}
+    if snapshot_dir is not None:
+        builders["similarities_snapshot"] = lambda _: load_snapshot_database(snapshot_dir)
+    if inverses is None:
+        inverses = compute_inverses([e["predicate"] for e in embeddings])
+
+    rows = []
+    for name, builder in builders.items():
+        start = time.perf_counter()
+        db = builder(embeddings)
+        build_seconds = time.perf_counter() - start
+        # The same inverse table for every backend, so only retrieval differs
+        db.inverses = inverses
+        memory = db.memory_usage()
+        row = {"backend": name, "build_s": build_seconds, "memory_bytes": memory["bytes"],
+               "shared_bytes": memory.get("shared_bytes", 0)}
+        row.update(evaluate_database(db, examples, ks, num_results))
+        rows.append(row)
+    return rows
+
+
+def fastest_meeting(rows, k, min_recall):
+    """ The backend with the lowest p95 latency whose recall@k reaches min_recall, or None. """
+    qualified = [row for row in rows if row[f"recall@{k}"] >= min_recall]
+    return min(qualified, key=lambda row: row["p95_ms"]) if qualified else None
+
+
+def print_report(rows, ks):
+    header = f"{'backend':<22}" + "".join(f"{f'R@{k}':>8}" for k in ks) + \
+        f"{'mean ms':>10}{'p95 ms':>10}{'build s':>9}{'MiB':>9}{'shared':>9}"
+    print(header)
+    for row in rows:
+        print(f"{row['backend']:<22}" + "".join(f"{row[f'recall@{k}']:>8.3f}" for k in ks) +
+              f"{row['mean_ms']:>10.3f}{row['p95_ms']:>10.3f}{row['build_s']:>9.2f}"
+              f"{row['memory_bytes'] / 2**20:>9.1f}{row['shared_bytes'] / 2**20:>9.1f}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Recall@k and latency of the retrieval backends on labeled phrases")
+    parser.add_argument("-l", "--labeled_file", required=True, help="JSON/JSONL of {relationship, predicate}")
+    parser.add_argument("-e", "--embeddings_file", default="data/all_biolink_mapped_vectors.json")
+    parser.add_argument("-b", "--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("-s", "--snapshot_dir", default=None, help="Also evaluate a memory-mapped snapshot")
+    parser.add_argument("-k", "--ks", nargs="+", type=int, default=[1, 3, 5, 10])
+    parser.add_argument("-n", "--num_results", type=int, default=10)
+    parser.add_argument("--min_recall", type=float, default=None, help="Accuracy floor for the recommendation")
+    parser.add_argument("--at_k", type=int, default=5, help="k of the recall the floor applies to")
+    parser.add_argument("-o", "--output_file", default=None, help="Write the report rows as JSON")
+    args = parser.parse_args()
+
+    with open(args.embeddings_file, "r") as f:
+        predicate_embeddings = json.load(f)
+    labeled = load_examples(args.labeled_file)
+    if any(example["embedding"] is None for example in labeled):
+        from src.llm_client import HEALpacaAsyncClient
+        asyncio.run(embed_examples(HEALpacaAsyncClient(), labeled, f"{args.labeled_file}.cache.jsonl"))
+
+    report = evaluate_backends(predicate_embeddings, labeled, args.backends, args.ks, args.num_results,
+                               args.snapshot_dir)
+    print_report(report, args.ks)
+    if args.min_recall is not None:
+        best = fastest_meeting(report, args.at_k, args.min_recall)
+        print(f"Fastest backend with recall@{args.at_k} >= {args.min_recall}: "
+              f"{best['backend'] if best else 'none'}")
+    if args.output_file is not None:
+        with open(args.output_file, "w") as f:
+            json.dump(report, f, indent=2)
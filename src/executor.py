@@ -0,0 +1,48 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+EXECUTOR_KINDS = ("thread", "process", "inline")
+
+
+class CPUExecutor:
+    """
+    Runs CPU-bound stages off the event loop. Work that needs the worker's index (searches) always runs on
+    threads, where NumPy, sklearn and the vectordb search release the GIL. With kind="process", standalone
+    functions of picklable arguments (response parsing) go to a process pool, so pure-Python work runs in
+    parallel too. "inline" runs everything on the event loop.
+    """
+    def __init__(self, kind="thread", workers=4):
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"Unknown executor {kind}; expected one of {EXECUTOR_KINDS}")
+        self.kind = kind
+        self.workers = workers
+        self.threads = ThreadPoolExecutor(workers, thread_name_prefix="cpu") if kind != "inline" else None
+        # Spawned, not forked: the worker already runs threads
+        self.processes = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) \
+            if kind == "process" else None
+        self.stats = {"offloaded": 0, "inline": 0}
+
+    async def run(self, fn, *args):
+        """ Run fn(*args) on a thread; fn may use objects of this process. """
+        return await self._run(self.threads, fn, *args)
+
+    async def run_pure(self, fn, *args):
+        """ Run fn(*args) in the process pool if there is one; fn and its arguments must be picklable. """
+        return await self._run(self.processes or self.threads, fn, *args)
+
+    async def _run(self, pool, fn, *args):
+        if pool is None:
+            self.stats["inline"] += 1
+            return fn(*args)
+        self.stats["offloaded"] += 1
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+    def shutdown(self):
+        for pool in (self.threads, self.processes):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+
+def chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
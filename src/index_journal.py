@@ -0,0 +1,72 @@
+import json
+import fcntl
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+UPDATE_OPERATIONS = ("add", "replace", "tombstone")
+
+
+def apply_update(db, op, entries):
+    """ Apply one update to a PredicateDatabase; returns the number of rows added, replaced or tombstoned. """
+    if op == "add":
+        return db.add_entries(entries)
+    if op == "replace":
+        return db.replace_entries(entries)
+    if op == "tombstone":
+        return db.tombstone_entries(entries)
+    raise ValueError(f"Unknown index update {op}; expected one of {UPDATE_OPERATIONS}")
+
+
+class IndexJournal:
+    """
+    Append-only log of index updates. Every worker replays it, so an update sent to any one worker reaches
+    the indexes of all of them. Records are tagged with the snapshot they apply to and records for another
+    snapshot are skipped, so rebuilding the snapshot starts from a clean history.
+    """
+    def __init__(self, path, base_version=""):
+        self.path = Path(path)
+        self.base_version = base_version
+        self.lock = threading.Lock()
+
+    def append(self, op, entries):
+        if op not in UPDATE_OPERATIONS:
+            raise ValueError(f"Unknown index update {op}; expected one of {UPDATE_OPERATIONS}")
+        line = json.dumps({"base": self.base_version, "op": op, "entries": entries}) + "\n"
+        with open(self.path, "a") as f:
+            # Several workers append to the same file
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(line)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def sync(self, db):
+        """ Apply the records appended since this index last synced; returns the number of records applied. """
+        index = db.index
+        with self.lock:
+            if not self.path.exists():
+                return 0
+            applied = 0
+            with open(self.path, "rb") as f:
+                f.seek(index.journal_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Partially written record; picked up on the next sync
+                        break
+                    index.journal_offset += len(line)
+                    record = json.loads(line)
+                    if record.get("base", "") != self.base_version:
+                        continue
+                    try:
+                        apply_update(db, record["op"], record["entries"])
+                    except ValueError as e:
+                        logger.error(f"Skipping index update {record['op']} from {self.path}: {e}")
+                    index.journal_records += 1
+                    applied += 1
+            if applied:
+                logger.info(f"Applied {applied} index updates from {self.path}")
+            return applied
@@ -1,11 +1,32 @@
+import os
+import ast
+import json
 import requests
 import asyncio
 import httpx
-from functools import lru_cache
+from contextlib import nullcontext
+from src.embedding_batcher import EmbeddingBatcher
+from src.admission import PrioritySemaphore
+from src.memory_accounting import ByteLRUCache
+from src.endpoint_pool import EndpointPool
+
+
+# Embeddings fetched by the synchronous client, bounded by size rather than entry count. Capped by the
+# same EMBEDDING_CACHE_BYTES as the async client's cache; the server reports it on /admin/memory/
+SYNC_EMBEDDING_CACHE = ByteLRUCache("sync_embeddings",
+                                    max_bytes=int(os.environ.get("EMBEDDING_CACHE_BYTES", str(32 * 2**20))))
 
 
-@lru_cache(maxsize=2048)
 def _cached_embedding_request( text: str ) -> list:
+    embedding = SYNC_EMBEDDING_CACHE.get(text)
+    if embedding is None:
+        embedding = _embedding_request(text)
+        if embedding is not None:
+            SYNC_EMBEDDING_CACHE.put(text, embedding)
+    return embedding
+
+
+def _embedding_request( text: str ) -> list:
     import requests
     request = {
         "model": "nomic-embed-text",
@@ -105,43 +126,214 @@ class HEALpacaAsyncClient:
         embedding_model="nomic-embed-text",
         api_url="https://healpaca.apps.renci.org/api/generate",
         embedding_url="https://healpaca.apps.renci.org/api/embeddings",
+        embedding_batch_url="https://healpaca.apps.renci.org/api/embed",
         chat_temperature=0.5,
+        stream=False,
     ):
         self.chat_model = chat_model
         self.embedding_model = embedding_model
         self.api_url = api_url
         self.embedding_url = embedding_url
+        self.embedding_batch_url = embedding_batch_url
         self.chat_temperature = chat_temperature
+        self.stream = stream
+        self.batcher = None
+        self.embedding_slots = None
+        self.rerank_slots = None
+        self.embedding_cache = None
+        self.chat_pool = None
+        self.embedding_pool = None
         self.headers = {"Content-Type": "application/json"}
 
-    async def _post(self, url: str, model: str, prompt: str) -> str:
+    def _request(self, model: str, prompt: str, format=None, stream=False) -> dict:
+        request = {
+            "model": model,
+            "prompt": prompt,
+            "stream": stream,
+            "temperature": self.chat_temperature,
+        }
+        if format is not None:
+            # "json" or a JSON schema the backend constrains its output to
+            request["format"] = format
+        return request
+
+    def _targets(self, url, pool):
+        """ URL to call and outcome tracker for each attempt of a call; only one attempt without a pool. """
+        if pool is None:
+            yield url, nullcontext()
+            return
+        for endpoint in pool.attempts():
+            yield endpoint.url_for(url), pool.track(endpoint)
+
+    async def _post(self, url: str, model: str, prompt: str, format=None, pool=None) -> str:
         async with httpx.AsyncClient(timeout=30.0) as client:
-            try:
-                response = await client.post(
-                    url,
-                    json={
-                        "model": model,
-                        "prompt": prompt,
-                        "stream": False,
-                        "temperature": self.chat_temperature,
-                    },
-                    headers=self.headers,
-                )
-                response.raise_for_status()
-                data = response.json()
-                return data.get("embedding") or data.get("response")
-            except Exception as e:
-                print(f"Request failed to {url}: {e}")
-                return None
+            for target, tracked in self._targets(url, pool):
+                try:
+                    with tracked:
+                        response = await client.post(target, json=self._request(model, prompt, format), headers=self.headers)
+                        response.raise_for_status()
+                        data = response.json()
+                    return data.get("embedding") or data.get("response")
+                except Exception as e:
+                    print(f"Request failed to {target}: {e}")
+            return None
+
+    async def _stream_post(self, url: str, model: str, prompt: str, format=None, stop_key=None, pool=None) -> str:
+        """
+        Stream a generate response and return as soon as the first complete JSON object (containing stop_key,
+        if given) has arrived. Leaving the stream early closes the connection, which stops generation on the
+        backend. Returns the whole response if no such object is produced.
+        """
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            for target, tracked in self._targets(url, pool):
+                scanner = JsonObjectScanner(stop_key)
+                tokens = []
+                try:
+                    with tracked:
+                        request = self._request(model, prompt, format, stream=True)
+                        async with client.stream("POST", target, json=request, headers=self.headers) as response:
+                            response.raise_for_status()
+                            async for line in response.aiter_lines():
+                                if not line.strip():
+                                    continue
+                                try:
+                                    data = json.loads(line)
+                                except json.JSONDecodeError:
+                                    # A malformed line loses its token, not the tokens collected so far
+                                    print(f"Skipping malformed stream line from {target}: {line[:200]}")
+                                    continue
+                                token = data.get("response", "")
+                                tokens.append(token)
+                                answer = scanner.feed(token)
+                                if answer is not None:
+                                    return answer
+                                if data.get("done"):
+                                    break
+                    return "".join(tokens)
+                except Exception as e:
+                    print(f"Request failed to {target}: {e}")
+            return None
+
+    def enable_endpoint_pools(self, chat_endpoints=None, embedding_endpoints=None, **pool_options):
+        """
+        Spread calls over several backends. Each list holds (base URL, weight) pairs and replaces the host of
+        api_url, or of embedding_url and embedding_batch_url; the API paths stay the same.
+        """
+        self.chat_pool = EndpointPool(chat_endpoints, **pool_options) if chat_endpoints else None
+        self.embedding_pool = EndpointPool(embedding_endpoints, **pool_options) if embedding_endpoints else None
+
+    def enable_micro_batching(self, max_wait: float = 0.005, max_batch_size: int = 64):
+        """ Route get_embedding through a batcher shared by every caller of this client. """
+        self.batcher = EmbeddingBatcher(self.get_batch_embeddings, self._get_single_embedding,
+                                        max_wait=max_wait, max_batch_size=max_batch_size)
+
+    def enable_priority_gates(self, embedding_limit: int = 0, rerank_limit: int = 0):
+        """ Cap concurrent embedding and rerank calls; waiting interactive requests get free slots first. """
+        self.embedding_slots = PrioritySemaphore(embedding_limit) if embedding_limit > 0 else None
+        self.rerank_slots = PrioritySemaphore(rerank_limit) if rerank_limit > 0 else None
+
+    def rerank_slot(self):
+        return self.rerank_slots.slot() if self.rerank_slots is not None else nullcontext()
+
+    def enable_embedding_cache(self, max_bytes: int):
+        """ Keep embeddings of repeated texts in a byte-capped LRU cache. """
+        self.embedding_cache = ByteLRUCache("embeddings", max_bytes)
 
     async def get_embedding(self, text: str):
-        return await self._post(self.embedding_url, self.embedding_model, text)
+        if self.embedding_cache is not None:
+            embedding = self.embedding_cache.get(text)
+            if embedding is not None:
+                return embedding
+        async with self.embedding_slots.slot() if self.embedding_slots is not None else nullcontext():
+            if self.batcher is not None:
+                embedding = await self.batcher.embed(text)
+            else:
+                embedding = await self._get_single_embedding(text)
+        if embedding is not None and self.embedding_cache is not None:
+            self.embedding_cache.put(text, embedding)
+        return embedding
+
+    async def _get_single_embedding(self, text: str):
+        return await self._post(self.embedding_url, self.embedding_model, text, pool=self.embedding_pool)
+
+    async def get_batch_embeddings(self, texts: list[str], timeout: float = 120.0):
+        """ Embed several texts in one call to the batch embed API; None if the call fails. """
+        request = {"model": self.embedding_model, "input": texts}
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            for target, tracked in self._targets(self.embedding_batch_url, self.embedding_pool):
+                try:
+                    with tracked:
+                        response = await client.post(target, json=request, headers=self.headers)
+                        response.raise_for_status()
+                        embeddings = response.json().get("embeddings")
+                        if embeddings is None or len(embeddings) != len(texts):
+                            raise ValueError(f"expected {len(texts)} embeddings")
+                    return embeddings
+                except Exception as e:
+                    print(f"Request failed to {target}: {e}")
+            return None
 
     async def get_chat_completion(self, prompt: str):
-        return await self._post(self.api_url, self.chat_model, prompt)
+        return await self._post(self.api_url, self.chat_model, prompt, pool=self.chat_pool)
+
+    async def get_structured_chat_completion(self, prompt: str, schema: dict):
+        """ Chat completion constrained to a JSON schema through the generate API's format option. """
+        return await self._post(self.api_url, self.chat_model, prompt, format=schema, pool=self.chat_pool)
+
+    async def get_streamed_chat_completion(self, prompt: str, format=None, stop_key=None):
+        """ Chat completion that stops reading once the answer object is complete. """
+        return await self._stream_post(self.api_url, self.chat_model, prompt, format=format, stop_key=stop_key,
+                                       pool=self.chat_pool)
 
     async def get_async_embeddings(self, texts: list[str]):
         return await asyncio.gather(*(self.get_embedding(text) for text in texts))
 
     async def get_async_chat_completions(self, prompts: list[str]):
         return await asyncio.gather(*(self.get_chat_completion(prompt) for prompt in prompts))
+
+
+class JsonObjectScanner:
+    """ Finds the end of the first complete top-level JSON object in text that arrives in pieces. """
+    def __init__(self, required_key=None):
+        self.required_key = required_key
+        self.buffer = []
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk: str):
+        """ Consume the next piece of text; returns the object text once it closes, otherwise None. """
+        for char in chunk:
+            if self.depth == 0 and char != "{":
+                continue
+            self.buffer.append(char)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    candidate = "".join(self.buffer)
+                    self.buffer = []
+                    if self.required_key is None or self._has_required_key(candidate):
+                        return candidate
+        return None
+
+    def _has_required_key(self, candidate):
+        """ The key must be a key of the object, not just appear in its text (a reasoning field naming it). """
+        try:
+            parsed = json.loads(candidate)
+        except json.JSONDecodeError:
+            try:
+                parsed = ast.literal_eval(candidate)
+            except (ValueError, SyntaxError):
+                return False
+        return isinstance(parsed, dict) and self.required_key in parsed
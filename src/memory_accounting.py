@@ -0,0 +1,103 @@
+import sys
+from collections import OrderedDict
+import numpy as np
+
+FLOAT_BYTES = sys.getsizeof(0.0)
+
+
+def deep_sizeof(obj, seen=None) -> int:
+    """ Approximate bytes held by an object and everything it references (arrays count their buffer). """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        # getsizeof already includes the buffer of an array that owns it; a view or memory map counts its header
+        return sys.getsizeof(obj)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(val, seen) for key, val in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        if obj and all(type(item) is float for item in obj):
+            # Embedding lists; skips a recursion per element
+            size += len(obj) * FLOAT_BYTES
+        else:
+            size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(type(obj), "__slots__"):
+        # Record types such as Candidates
+        size += sum(deep_sizeof(getattr(obj, slot, None), seen) for slot in type(obj).__slots__)
+    return size
+
+
+class ByteLRUCache:
+    """ LRU cache bounded by the approximate size of its keys and values; the oldest entries are evicted. """
+    def __init__(self, name, max_bytes, sizeof=deep_sizeof):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return default
+        self.stats["hits"] += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(key) + self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.bytes -= evicted
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def state(self):
+        return {"bytes": self.bytes, "max_bytes": self.max_bytes, "entries": len(self.entries), **self.stats}
+
+
+class MemoryRegistry:
+    """
+    Long-lived structures of a worker and the memory they hold. A structure reports a dict with "bytes" of
+    private memory and, optionally, "shared_bytes" of pages shared with other workers (a memory-mapped index).
+    """
+    def __init__(self):
+        self.structures = {}
+        self.caches = {}
+
+    def register(self, name, usage):
+        self.structures[name] = usage
+
+    def register_cache(self, cache: ByteLRUCache):
+        self.caches[cache.name] = cache
+
+    def report(self) -> dict:
+        structures = {name: usage() for name, usage in self.structures.items()}
+        caches = {name: cache.state() for name, cache in self.caches.items()}
+        return {
+            "structures": structures,
+            "caches": caches,
+            "accounted_bytes": sum(s["bytes"] for s in structures.values()) + sum(c["bytes"] for c in caches.values()),
+            "shared_bytes": sum(s.get("shared_bytes", 0) for s in structures.values()),
+            "cache_limit_bytes": sum(c["max_bytes"] for c in caches.values()),
+        }
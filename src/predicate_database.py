@@ -1,11 +1,18 @@
 import json
+import threading
+from pathlib import Path
 import numpy as np
 import torch
 from sklearn.neighbors import NearestNeighbors
-from scipy.spatial.distance import cdist
 from vectordb import InMemoryExactNNVectorDB
 from docarray import BaseDoc, DocList
 from docarray.typing import NdArray
+from src.memory_accounting import deep_sizeof
+
+
+INDEX_VECTORS_FILE = "vectors.npy"
+INDEX_PREDICATE_IDS_FILE = "predicate_ids.npy"
+INDEX_METADATA_FILE = "index.json"
 
 
 class PredicateText(BaseDoc):
@@ -14,16 +21,139 @@ class PredicateText(BaseDoc):
     embedding: NdArray[768]
 
 
+class LexicalIndex:
+    """ Rows of the predicate texts by lexical_key, so known phrasings can be found without an embedding. """
+    __slots__ = ("rows",)
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @classmethod
+    def build(cls, texts, start=0, rows=None):
+        rows = dict(rows or {})
+        for row, text in enumerate(texts, start):
+            key = lexical_key(text)
+            if key:
+                rows[key] = rows.get(key, ()) + (row,)
+        return cls(rows)
+
+    def extended(self, texts, start):
+        """ A copy with rows start, start + 1, ... added; this index is left unchanged. """
+        return LexicalIndex.build(texts, start, self.rows)
+
+    def lookup(self, text, texts, live=None):
+        """ A live row matching the text, preferring one that differs only in case, spacing or underscores. """
+        rows = [row for row in self.rows.get(lexical_key(text), ()) if live is None or live[row]]
+        if not rows:
+            return None
+        normalized = normalize_text(text)
+        return next((row for row in rows if normalize_text(texts[row]) == normalized), rows[0])
+
+
+class IndexState:
+    """
+    Immutable view of the matrix index. Rows are the base matrix (usually memory-mapped) followed by the
+    small in-memory delta of added rows; tombstoned rows are masked out of searches by `live`.
+    """
+    __slots__ = ("embeddings", "delta", "predicates", "texts", "predicate_table", "predicate_ids", "live",
+                 "generation", "lexicon")
+
+    def __init__(self, embeddings, predicates, texts, predicate_table, predicate_ids, delta=None, live=None,
+                 generation=0, lexicon=None):
+        self.embeddings = embeddings
+        self.delta = delta
+        self.predicates = predicates
+        self.texts = texts
+        self.predicate_table = predicate_table
+        self.predicate_ids = predicate_ids
+        self.live = live
+        self.generation = generation
+        self.lexicon = lexicon if lexicon is not None else LexicalIndex.build(texts)
+
+    @property
+    def rows(self):
+        return len(self.predicates)
+
+    @property
+    def live_rows(self):
+        return self.rows if self.live is None else int(self.live.sum())
+
+    def matrix(self):
+        """ Base and delta rows as one matrix; only copies when there is a delta. """
+        if self.delta is None:
+            return self.embeddings
+        return np.concatenate([self.embeddings, self.delta])
+
+    def row_vector(self, row):
+        base_rows = len(self.embeddings)
+        return self.embeddings[row] if row < base_rows else self.delta[row - base_rows]
+
+    def lexical_row(self, text):
+        return self.lexicon.lookup(text, self.texts, self.live)
+
+    def similarities(self, queries):
+        """ Dot products of a query, or of each row of a query matrix, with every row. """
+        similarities = queries @ self.embeddings.T
+        if self.delta is not None:
+            similarities = np.concatenate([similarities, queries @ self.delta.T], axis=-1)
+        if self.live is not None:
+            similarities[..., ~self.live] = -np.inf
+        return similarities
+
+
+class PredicateIndex:
+    """ Copy-on-write holder for the matrix index: writers swap in a new state, searches never wait. """
+    def __init__(self, state):
+        self.state = state
+        self.lock = threading.Lock()
+        # Position and record count of the update journal already applied to this index
+        self.journal_offset = 0
+        self.journal_records = 0
+
+
 class PredicateDatabase:
     def __init__(self, client, is_vdb = False, is_nn=False):
-        self.all_pred_emb = None
-        self.all_pred_texts = None
-        self.all_pred = None
+        self.index = None
         self.db = None
+        self.inverses = None
+        # Estimated size of the documents indexed by the vectordb backend
+        self.vdb_bytes = 0
+        # Optional cache of the top-N candidates of a relationship text, see process_single_edge
+        self.candidate_cache = None
+        # Use the stored vector of a predicate text matching the relationship instead of embedding it
+        self.lexical_shortcut = False
+        # Lexical index of the vectordb documents, which the vectordb itself cannot look up by text; built on the
+        # first lexical_vector call, so only when the shortcut is used
+        self.vdb_docs = []
+        self.vdb_lexicon = None
         self.client = client
         self.is_vdb = is_vdb
         self.is_nn = is_nn
 
+    @property
+    def all_pred_emb(self):
+        return None if self.index is None else self.index.state.matrix()
+
+    @property
+    def all_pred(self):
+        return None if self.index is None else self.index.state.predicates
+
+    @property
+    def all_pred_texts(self):
+        return None if self.index is None else self.index.state.texts
+
+    @property
+    def predicate_table(self):
+        return None if self.index is None else self.index.state.predicate_table
+
+    @property
+    def predicate_ids(self):
+        return None if self.index is None else self.index.state.predicate_ids
+
+    @property
+    def generation(self):
+        return 0 if self.index is None else self.index.state.generation
+
     def load_db_from_json(self, embeddings_file):
         # print("Loading json")
         with open(embeddings_file, "r") as f:
@@ -45,69 +175,336 @@ class PredicateDatabase:
             # print("Load vectordb")
             self.db = InMemoryExactNNVectorDB[PredicateText](workspace='./workspace')
             self.db.index(inputs=DocList[PredicateText](doc_list))
+            self.vdb_bytes = sum(doc.embedding.nbytes + deep_sizeof([doc.predicate, doc.text]) for doc in doc_list)
+            # References to the indexed documents, for lexical_vector; their vectors are not copied
+            self.vdb_docs = doc_list
+            self.vdb_lexicon = None
         else:
-            self.all_pred_texts = [e.get("text", "") for e in embeddings]
-            self.all_pred = [e.get("predicate", "") for e in embeddings]
-            self.all_pred_emb = [e.get("embedding", []) for e in embeddings]
-            self.all_pred_emb = transform_embedding(self.all_pred_emb)
+            predicates = [e.get("predicate", "") for e in embeddings]
+            predicate_table, predicate_ids = canonical_ids(predicates)
+            self.index = PredicateIndex(IndexState(
+                embeddings=normalize_rows([e.get("embedding", []) for e in embeddings]),
+                predicates=predicates,
+                texts=[e.get("text", "") for e in embeddings],
+                predicate_table=predicate_table,
+                predicate_ids=predicate_ids,
+            ))
         # print("Ready")
 
+    def save_index(self, index_dir, inverses=None):
+        """ Write the predicate matrix and metadata so other processes can memory-map them. """
+        if self.is_vdb:
+            raise ValueError("The vectordb backend keeps a private per-process index and cannot be saved")
+        state = self._compacted_state(self.index.state)
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        np.save(index_dir / INDEX_VECTORS_FILE, np.ascontiguousarray(state.embeddings, dtype=np.float32))
+        np.save(index_dir / INDEX_PREDICATE_IDS_FILE, state.predicate_ids)
+        with open(index_dir / INDEX_METADATA_FILE, "w") as f:
+            json.dump({
+                "predicate_table": state.predicate_table,
+                "texts": state.texts,
+                "inverses": inverses if inverses is not None else self.inverses or {},
+            }, f)
+
+    def load_index(self, index_dir, mmap=True):
+        """ Load an index written by save_index. With mmap the matrix pages are shared by every process. """
+        if self.is_vdb:
+            raise ValueError("The vectordb backend keeps a private per-process index and cannot be loaded")
+        index_dir = Path(index_dir)
+        mmap_mode = "r" if mmap else None
+        with open(index_dir / INDEX_METADATA_FILE, "r") as f:
+            metadata = json.load(f)
+        predicate_table = metadata["predicate_table"]
+        predicate_ids = np.load(index_dir / INDEX_PREDICATE_IDS_FILE, mmap_mode=mmap_mode)
+        self.inverses = metadata.get("inverses")
+        self.index = PredicateIndex(IndexState(
+            embeddings=np.load(index_dir / INDEX_VECTORS_FILE, mmap_mode=mmap_mode),
+            predicates=[predicate_table[i] for i in predicate_ids],
+            texts=metadata["texts"],
+            predicate_table=predicate_table,
+            predicate_ids=predicate_ids,
+        ))
+
+    def add_entries(self, entries):
+        """ Append predicate entries ({"predicate", "text", "embedding"}) without rebuilding the index. """
+        with self._writer():
+            state = self.index.state
+            self.index.state = self._with_entries(state, entries, live=state.live)
+        return len(entries)
+
+    def replace_entries(self, entries):
+        """ Tombstone the live rows with the same text as each entry, then add the entries, in one swap. """
+        with self._writer():
+            state = self.index.state
+            live = self._tombstone_mask(state, [{"text": e["text"]} for e in entries])
+            replaced = state.live_rows - int(live.sum())
+            self.index.state = self._with_entries(state, entries, live=live)
+        return replaced
+
+    def tombstone_entries(self, selectors):
+        """
+        Hide the rows matching any selector from searches. A selector has a "predicate", a "text" or both;
+        rows stay in the matrix until the next compaction. Returns the number of rows tombstoned.
+        """
+        with self._writer():
+            state = self.index.state
+            live = self._tombstone_mask(state, selectors)
+            removed = state.live_rows - int(live.sum())
+            if removed:
+                self.index.state = IndexState(state.embeddings, state.predicates, state.texts, state.predicate_table,
+                                              state.predicate_ids, delta=state.delta, live=live,
+                                              generation=state.generation + 1, lexicon=state.lexicon)
+        return removed
+
+    def compact(self):
+        """ Fold the delta into the base matrix and drop tombstoned rows. """
+        with self._writer():
+            state = self.index.state
+            self.index.state = self._compacted_state(state)
+        return self.index.state.rows
+
+    def needs_compaction(self, max_delta_rows=1000, max_dead_rows=1000):
+        if self.index is None:
+            return False
+        state = self.index.state
+        delta_rows = 0 if state.delta is None else len(state.delta)
+        return delta_rows > max_delta_rows or state.rows - state.live_rows > max_dead_rows
+
+    def index_stats(self):
+        state = self.index.state
+        return {
+            "rows": state.rows,
+            "live_rows": state.live_rows,
+            "delta_rows": 0 if state.delta is None else len(state.delta),
+            "generation": state.generation,
+            "journal_records": self.index.journal_records,
+        }
+
+    def memory_usage(self):
+        """ Bytes held by the index; memory-mapped rows count as shared, since every worker maps the same pages. """
+        if self.is_vdb:
+            lexicon_bytes = deep_sizeof(self.vdb_lexicon[0].rows) if self.vdb_lexicon is not None else 0
+            return {"bytes": self.vdb_bytes + lexicon_bytes, "lexicon_bytes": lexicon_bytes, "backend": "vectordb"}
+        state = self.index.state
+        arrays = [array for array in (state.embeddings, state.delta, state.predicate_ids, state.live) if array is not None]
+        metadata_bytes = deep_sizeof([state.predicates, state.texts, state.predicate_table, self.inverses])
+        lexicon_bytes = deep_sizeof(state.lexicon.rows)
+        return {
+            "bytes": metadata_bytes + lexicon_bytes + sum(array.nbytes for array in arrays
+                                                          if not isinstance(array, np.memmap)),
+            "shared_bytes": sum(array.nbytes for array in arrays if isinstance(array, np.memmap)),
+            "matrix_bytes": state.embeddings.nbytes,
+            "delta_bytes": 0 if state.delta is None else state.delta.nbytes,
+            "metadata_bytes": metadata_bytes,
+            "lexicon_bytes": lexicon_bytes,
+            "backend": "matrix",
+        }
+
+    def validate_update(self, op, entries):
+        """ Raise ValueError for an update that could not be applied, before it is journaled. """
+        if self.is_vdb or self.index is None:
+            raise ValueError("Incremental updates are only supported on the matrix index")
+        dim = self.index.state.embeddings.shape[1]
+        for entry in entries:
+            if op == "tombstone":
+                if entry.get("predicate") is None and entry.get("text") is None:
+                    raise ValueError("A tombstone selector needs a predicate, a text or both")
+            elif len(entry.get("embedding") or []) != dim:
+                raise ValueError(f"Expected a {dim}-dimensional embedding for {entry.get('text')}")
+
+    def _writer(self):
+        """ Lock serializing writers; each writer copies from the current state and swaps in its result. """
+        if self.is_vdb or self.index is None:
+            raise ValueError("Incremental updates are only supported on the matrix index")
+        return self.index.lock
+
+    @staticmethod
+    def _tombstone_mask(state, selectors):
+        live = np.ones(state.rows, dtype=bool) if state.live is None else state.live.copy()
+        table_positions = {predicate: i for i, predicate in enumerate(state.predicate_table)}
+        for selector in selectors:
+            predicate, text = selector.get("predicate"), selector.get("text")
+            if predicate is None and text is None:
+                raise ValueError("A tombstone selector needs a predicate, a text or both")
+            matched = np.ones(state.rows, dtype=bool)
+            if predicate is not None:
+                position = table_positions.get(predicate)
+                if position is None:
+                    continue
+                matched &= state.predicate_ids == position
+            if text is not None:
+                # The lexicon narrows the rows down to a handful; only an exact text match is removed
+                rows = state.lexicon.rows.get(lexical_key(text)) if lexical_key(text) else range(state.rows)
+                text_rows = np.zeros(state.rows, dtype=bool)
+                text_rows[[row for row in rows or () if state.texts[row] == text]] = True
+                matched &= text_rows
+            live &= ~matched
+        return live
+
+    @staticmethod
+    def _with_entries(state, entries, live):
+        if not entries:
+            return state
+        predicate_table = list(state.predicate_table)
+        positions = {predicate: i for i, predicate in enumerate(predicate_table)}
+        for entry in entries:
+            if entry["predicate"] not in positions:
+                positions[entry["predicate"]] = len(predicate_table)
+                predicate_table.append(entry["predicate"])
+        added = normalize_rows([entry["embedding"] for entry in entries])
+        if added.shape[1] != state.embeddings.shape[1]:
+            raise ValueError(f"Expected {state.embeddings.shape[1]}-dimensional embeddings, got {added.shape[1]}")
+        if live is not None:
+            live = np.concatenate([live, np.ones(len(entries), dtype=bool)])
+        return IndexState(
+            embeddings=state.embeddings,
+            delta=added if state.delta is None else np.concatenate([state.delta, added]),
+            predicates=state.predicates + [entry["predicate"] for entry in entries],
+            texts=state.texts + [entry["text"] for entry in entries],
+            predicate_table=predicate_table,
+            predicate_ids=np.concatenate([
+                state.predicate_ids, np.array([positions[e["predicate"]] for e in entries], dtype=np.int32)
+            ]),
+            live=live,
+            generation=state.generation + 1,
+            lexicon=state.lexicon.extended([entry["text"] for entry in entries], state.rows),
+        )
+
+    @staticmethod
+    def _compacted_state(state):
+        if state.delta is None and state.live is None:
+            return state
+        keep = np.arange(state.rows) if state.live is None else np.flatnonzero(state.live)
+        predicates = [state.predicates[i] for i in keep]
+        predicate_table, predicate_ids = canonical_ids(predicates)
+        return IndexState(
+            embeddings=np.ascontiguousarray(state.matrix()[keep]),
+            predicates=predicates,
+            texts=[state.texts[i] for i in keep],
+            predicate_table=predicate_table,
+            predicate_ids=predicate_ids,
+            generation=state.generation + 1,
+        )
+
+    def lexical_vector(self, text):
+        """ Stored unit vector of a live predicate text matching the text lexically, or None. """
+        if self.is_vdb:
+            if self.vdb_lexicon is None:
+                texts = [doc.text for doc in self.vdb_docs]
+                self.vdb_lexicon = (LexicalIndex.build(texts), texts)
+            lexicon, texts = self.vdb_lexicon
+            row = lexicon.lookup(text, texts)
+            return None if row is None else normalize_rows(self.vdb_docs[row].embedding)[0]
+        state = self.index.state
+        row = state.lexical_row(text)
+        return None if row is None else state.row_vector(row)
+
     async def search(self, text, embedding=None, num_results=10):
         if embedding is None:
             embedding = await self.client.get_embedding(text)
         if embedding is None or (hasattr(embedding, '__len__') and len(embedding) == 0):
             return None
+        return self.search_batch([text], [embedding], num_results)[0]
 
+    def search_batch(self, texts, embeddings, num_results=10):
+        """
+        Search several embedded queries at once, with one vectordb call, one kneighbors call or one matrix
+        product for the whole batch. Synchronous, so callers can run it off the event loop. The embeddings are a
+        list of vectors or a 2-D float32 array.
+        """
         if self.is_vdb:
-            query = PredicateText(text=text, embedding=embedding)
-            results = self.db.search(inputs=DocList[PredicateText]([query]), limit=num_results)
-
-            texts = [match.text for match in results[0].matches]
-            predicates = [match.predicate for match in results[0].matches]
-            scores = [score for score in results[0].scores]
-
-            results_dict = {
-                i: {
-                    "text": t,
-                    "mapped_predicate": p,
-                    "score": float(s)
-                } for i, (t, p, s) in enumerate(zip(texts, predicates, scores))
-            }
-            return results_dict
+            queries = DocList[PredicateText]([PredicateText(text=t, embedding=e) for t, e in zip(texts, embeddings)])
+            return [
+                {
+                    i: {
+                        "text": match.text,
+                        "mapped_predicate": match.predicate,
+                        "score": float(score)
+                    } for i, (match, score) in enumerate(zip(result.matches, result.scores))
+                }
+                for result in self.db.search(inputs=queries, limit=num_results)
+            ]
 
-        embedding = transform_embedding(embedding)
+        if isinstance(embeddings, np.ndarray):
+            # Rows of a request's embedding block
+            queries = normalize_rows(embeddings)
+        else:
+            queries = normalize_rows(torch.stack([transform_embedding(embedding) for embedding in embeddings]))
+        # One read of the state: a concurrent update swaps in a new state without affecting this search
+        state = self.index.state
 
         if self.is_nn:
-            model = NearestNeighbors(n_neighbors=num_results, metric="cosine")
-            model.fit(self.all_pred_emb)
-            dist, indices = model.kneighbors([embedding])
-            similarities = 1 - dist
-
-            return {
-                idx: {
-                    "text": self.all_pred_texts[idx],
-                    "mapped_predicate": self.all_pred[idx],
-                    "score": float(sim)
-                }
-                for idx, sim in zip(indices[0], similarities[0])
-            }
+            rows = np.arange(state.rows) if state.live is None else np.flatnonzero(state.live)
+            model = NearestNeighbors(n_neighbors=min(num_results, len(rows)), metric="cosine")
+            model.fit(state.matrix() if state.live is None else state.matrix()[rows])
+            dist, indices = model.kneighbors(queries)
+            return [
+                {int(rows[idx]): self._match(state, rows[idx], 1 - d) for idx, d in zip(row_indices, row_dist)}
+                for row_indices, row_dist in zip(indices, dist)
+            ]
 
-        similarities = 1 - cdist([embedding.cpu().detach().numpy()], self.all_pred_emb, metric="cosine")
-        similarities = similarities.flatten()
-        top_k = min(num_results, len(similarities))
-        top_indices = np.argsort(-similarities)[:top_k]
-        return {
-            idx: {
-                "text": self.all_pred_texts[idx],
-                "mapped_predicate": self.all_pred[idx],
-                "score": float(similarities[idx])
-            }
-            for idx in top_indices
-        }
+        top_k = min(num_results, state.live_rows)
+        if top_k == 0:
+            return [{} for _ in texts]
+        # Rows and queries are unit length, so the dot products are the cosine similarities
+        similarities = state.similarities(queries)
+        top_indices = np.argpartition(-similarities, top_k - 1, axis=1)[:, :top_k]
+        top_scores = np.take_along_axis(similarities, top_indices, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top_indices = np.take_along_axis(top_indices, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [
+            {int(idx): self._match(state, idx, score) for idx, score in zip(row_indices, row_scores)}
+            for row_indices, row_scores in zip(top_indices, top_scores)
+        ]
+
+    @staticmethod
+    def _match(state, idx, score):
+        return {"text": state.texts[idx], "mapped_predicate": state.predicates[idx], "score": float(score)}
 
 
 def transform_embedding(embedding):
     if isinstance(embedding, torch.Tensor):
         return embedding.clone().detach().float()
     else:
-        return torch.tensor(embedding, dtype=torch.float32)
\ No newline at end of file
+        return torch.tensor(embedding, dtype=torch.float32)
+
+
+def canonical_ids(predicates):
+    """ Sorted table of distinct predicates and the int32 table position of every row. """
+    table = sorted(set(predicates))
+    positions = {predicate: i for i, predicate in enumerate(table)}
+    return table, np.array([positions[p] for p in predicates], dtype=np.int32)
+
+
+def normalize_text(text):
+    """ Case, whitespace, hyphen and underscore insensitive form of a predicate text. """
+    return " ".join(text.replace("biolink:", "").replace("_", " ").replace("-", " ").lower().split())
+
+
+def _stem(word):
+    if len(word) <= 3:
+        return word
+    # A plural, then a participle: "phrasings" -> "phrasing" -> "phras"
+    for suffixes in (("es", "s"), ("ing", "ed")):
+        for suffix in suffixes:
+            if word.endswith(suffix) and not word.endswith("ss") and len(word) - len(suffix) >= 3:
+                word = word[:-len(suffix)]
+                break
+    return word[:-1] if word.endswith("e") and len(word) > 3 else word
+
+
+def lexical_key(text):
+    """ normalize_text with simple inflections folded: "Increases_expression of" and "increased expression of" match. """
+    return " ".join(_stem(word) for word in normalize_text(text).split())
+
+
+def normalize_rows(embeddings):
+    """ Float32 matrix with unit-length rows; all-zero rows are left as zeros. """
+    if isinstance(embeddings, torch.Tensor):
+        embeddings = embeddings.cpu().detach().numpy()
+    matrix = np.array(embeddings, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
@@ -0,0 +1,113 @@
+import threading
+import numpy as np
+
+
+class CandidateVocabulary:
+    """
+    Candidate predicate names, in the form of the Top_n_candidates keys ("treated by"), by integer id.
+    Append-only and shared by every database and request of a worker, so cached candidates stay valid.
+    """
+    __slots__ = ("names", "ids", "lock")
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def id_of(self, name) -> int:
+        # Searches run on executor threads; the name is stored before its id is published
+        candidate_id = self.ids.get(name)
+        if candidate_id is None:
+            with self.lock:
+                candidate_id = self.ids.get(name)
+                if candidate_id is None:
+                    self.names.append(name)
+                    candidate_id = self.ids[name] = len(self.names) - 1
+        return candidate_id
+
+
+CANDIDATE_NAMES = CandidateVocabulary()
+
+
+class Candidates:
+    """ Ranked candidates of a relationship: int32 vocabulary ids and float32 scores, best first. """
+    __slots__ = ("ids", "scores")
+
+    def __init__(self, ids, scores):
+        self.ids = ids
+        self.scores = scores
+
+    @classmethod
+    def from_ranked(cls, ranked):
+        """ From (name, score) pairs in rank order. """
+        ids = np.fromiter((CANDIDATE_NAMES.id_of(name) for name, _ in ranked), dtype=np.int32, count=len(ranked))
+        scores = np.fromiter((score for _, score in ranked), dtype=np.float32, count=len(ranked))
+        return cls(ids, scores)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def names(self) -> list:
+        return [CANDIDATE_NAMES.names[candidate_id] for candidate_id in self.ids.tolist()]
+
+    def as_dict(self) -> dict:
+        """ {name: score}, as in the Top_n_candidates of lookup_unique_predicates. """
+        # Scores were rounded to 5 decimals before they were stored, so rounding recovers them exactly
+        return {name: round(score, 5) for name, score in zip(self.names(), self.scores.tolist())}
+
+    def as_response(self) -> dict:
+        """ {rank: {"mapped_predicate": name, "score": score}}, as in the /query/ response. """
+        return {rank: {"mapped_predicate": name, "score": score}
+                for rank, (name, score) in enumerate(self.as_dict().items())}
+
+
+class TripleRecord:
+    """
+    One triple on its way through the pipeline. `row` is the position of its relationship embedding in the
+    request's embedding block (-1 without one); the public result dict is only built by as_result. A triple
+    that cannot be looked up keeps its place in the results with an `error` instead.
+    """
+    __slots__ = ("subject", "object", "relationship", "abstract", "row", "candidates", "top_choice", "error")
+
+    def __init__(self, relationship, subject=None, object=None, abstract=None, error=None):
+        self.subject = subject
+        self.object = object
+        self.relationship = relationship
+        self.abstract = abstract
+        self.row = -1
+        self.candidates = None
+        self.top_choice = None
+        self.error = error
+
+    @classmethod
+    def from_edge(cls, edge):
+        relationship = edge.get("relationship")
+        error = "Missing 'relationship'" if not isinstance(relationship, str) else None
+        return cls(relationship, edge.get("subject"), edge.get("object"), edge.get("abstract"), error)
+
+    def candidate_names(self) -> list:
+        return self.candidates.names() if self.candidates is not None else []
+
+    def as_result(self, method) -> dict:
+        result = {
+            "subject": self.subject,
+            "object": self.object,
+            "relationship": self.relationship,
+            "abstract": self.abstract,
+            "Top_n_candidates": self.candidates.as_response() if self.candidates is not None else {},
+            "Top_n_retrieval_method": method,
+            "top_choice": self.top_choice,
+        }
+        if self.error is not None:
+            result["error"] = self.error
+        return result
+
+
+def embedding_block(vectors) -> np.ndarray:
+    """ One float32 row per embedding (lists, arrays or tensors of the same length). """
+    if not vectors:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack([np.asarray(vector, dtype=np.float32) for vector in vectors])
@@ -0,0 +1,68 @@
+import orjson
+import msgpack
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+# "error" is only sent for triples that could not be mapped
+RESULT_FIELDS = ("subject", "object", "relationship", "top_choice", "Top_n_candidates", "Top_n_retrieval_method",
+                 "error")
+
+
+class CompactFormatError(ValueError):
+    pass
+
+
+def decode_body(body: bytes, content_type: str):
+    """ Decode a request body sent as MessagePack or JSON, according to its content type. """
+    try:
+        if content_type.startswith(MSGPACK_MEDIA_TYPE):
+            return msgpack.unpackb(body, raw=False, strict_map_key=False)
+        return orjson.loads(body)
+    except (msgpack.ExtraData, msgpack.FormatError, msgpack.StackError, ValueError) as e:
+        raise CompactFormatError(f"Could not decode the request body: {e}")
+
+
+def compact_triples(triples: list[dict]) -> dict:
+    """
+    Compact request payload: each distinct abstract is sent once and triples refer to it by position,
+    {"abstracts": [...], "triples": [[subject, object, relationship, abstract_index], ...]}.
+    """
+    positions = {}
+    compact = []
+    for triple in triples:
+        index = positions.setdefault(triple["abstract"], len(positions))
+        compact.append([triple["subject"], triple["object"], triple["relationship"], index])
+    return {"abstracts": list(positions), "triples": compact}
+
+
+def expand_compact_triples(payload) -> list[dict]:
+    """ Pipeline input dicts from a compact payload; triples of the same abstract share one string. """
+    if not isinstance(payload, dict):
+        raise CompactFormatError("Expected an object with 'abstracts' and 'triples'")
+    abstracts, triples = payload.get("abstracts"), payload.get("triples")
+    if not isinstance(abstracts, list) or not isinstance(triples, list):
+        raise CompactFormatError("Expected 'abstracts' and 'triples' lists")
+    if not all(isinstance(abstract, str) for abstract in abstracts):
+        raise CompactFormatError("Every abstract must be a string")
+
+    expanded = []
+    for position, triple in enumerate(triples):
+        if not isinstance(triple, (list, tuple)) or len(triple) != 4:
+            raise CompactFormatError(f"Triple {position} must be [subject, object, relationship, abstract_index]")
+        subject, object_, relationship, index = triple
+        if not (isinstance(subject, str) and isinstance(object_, str) and isinstance(relationship, str)):
+            raise CompactFormatError(f"Triple {position} must have string subject, object and relationship")
+        if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < len(abstracts):
+            raise CompactFormatError(f"Triple {position} refers to abstract {index}, which does not exist")
+        expanded.append({"abstract": abstracts[index], "subject": subject, "object": object_,
+                         "relationship": relationship})
+    return expanded
+
+
+def encode_results(results: list[dict], accept: str = JSON_MEDIA_TYPE):
+    """ Encode pipeline results in the /query/ response shape as MessagePack or JSON; returns (body, media type). """
+    content = {"results": [{field: result.get(field) for field in RESULT_FIELDS
+                            if field != "error" or result.get("error") is not None} for result in results]}
+    if MSGPACK_MEDIA_TYPE in accept:
+        return msgpack.packb(content, use_bin_type=True), MSGPACK_MEDIA_TYPE
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS), JSON_MEDIA_TYPE
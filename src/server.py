@@ -1,16 +1,31 @@
+import os
+import copy
+import hmac
 import json
+import asyncio
 from enum import Enum
+from functools import lru_cache
 from pathlib import Path
 import logging
 import traceback
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, ORJSONResponse, Response
 from pydantic import BaseModel, Extra, Field
 from typing import List, Dict, Optional
 from src import biolink_predicate_lookup as blp
+from src.llm_client import SYNC_EMBEDDING_CACHE
+from src.worker_memory import process_memory
+from src.snapshot import load_snapshot
+from src.index_journal import IndexJournal, apply_update
+from src.serialization import decode_body, expand_compact_triples, encode_results, CompactFormatError
+from src.admission import AdmissionController, Overloaded, Priority
+from src.memory_accounting import MemoryRegistry, ByteLRUCache, deep_sizeof
+from src.warmup import WarmupProgress, read_phrases, warm_caches
+from src.endpoint_pool import parse_endpoints
+from src.executor import CPUExecutor
 
-APP = FastAPI()
+APP = FastAPI(default_response_class=ORJSONResponse)
 
 
 @APP.get("/", include_in_schema=False)
@@ -49,6 +64,11 @@ class RetrievalMethod(str, Enum):
     vectordb = "vectordb"
 
 
+class RerankMode(str, Enum):
+    text = "text"
+    structured = "structured"
+
+
 class Candidate(BaseModel):
     mapped_predicate: str
     score: float
@@ -65,21 +85,103 @@ class PredicateChoice(BaseModel):
 class PredicateResult(BaseModel):
     subject: str
     object: str
-    relationship: str
-    top_choice: PredicateChoice
+    relationship: Optional[str]
+    # None, with an error, for a triple that could not be mapped
+    top_choice: Optional[PredicateChoice]
     Top_n_candidates: Dict[int, Candidate]
     Top_n_retrieval_method: str
+    error: Optional[str] = None
 
 
 class QueryResponse(BaseModel):
     results: List[PredicateResult]
 
 
+class PredicateEntry(BaseModel):
+    predicate: str = Field(..., example="biolink:treats")
+    text: str = Field(..., example="is a therapy for")
+    embedding: Optional[List[float]] = Field(default=None, description="Embedded with the service model if omitted")
+
+
+class PredicateSelector(BaseModel):
+    predicate: Optional[str] = Field(default=None, example="biolink:treats")
+    text: Optional[str] = Field(default=None, example="is a therapy for")
+
+
 BASE_DIR = Path(__file__)
 BASE_DIR = Path(__file__).resolve().parent
 DESCRIPTION_FILE = BASE_DIR.parent / "data" / "short_description.json"
 EMBEDDING_FILE = BASE_DIR.parent / "data" / "all_biolink_mapped_vectors.json"
 QUALIFIED_PREDICATE_FILE = BASE_DIR.parent / "data" / "qualified_predicate_mapping.json"
+# Versioned snapshot built by src.snapshot; when set, every worker loads it at startup and maps the same
+# predicate matrix instead of building its own index from the JSON files
+PREDICATE_SNAPSHOT_DIR = os.environ.get("PREDICATE_SNAPSHOT_DIR")
+# Stream rerank completions and stop reading as soon as the answer object is complete
+STREAM_RERANK = os.environ.get("STREAM_RERANK", "false").lower() == "true"
+# Default latency budget of a query in seconds; reranks still running when it is spent are cancelled and
+# their triples get the top vector candidate. 0 disables the budget
+MAX_LATENCY = float(os.environ.get("MAX_LATENCY", "0"))
+# Window and size limit of the embedding micro-batcher shared by all requests; a window of 0 disables it
+EMBEDDING_BATCH_WINDOW_MS = float(os.environ.get("EMBEDDING_BATCH_WINDOW_MS", "0"))
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "64"))
+# Admission control per worker; 0 disables a limit. Bulk requests may use BULK_SHARE of the in-flight triples,
+# and requests over INTERACTIVE_MAX_TRIPLES are always bulk
+MAX_INFLIGHT_TRIPLES = int(os.environ.get("MAX_INFLIGHT_TRIPLES", "0"))
+MAX_REQUEST_TRIPLES = int(os.environ.get("MAX_REQUEST_TRIPLES", "0"))
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", "0"))
+BULK_SHARE = float(os.environ.get("BULK_SHARE", "0.5"))
+INTERACTIVE_MAX_TRIPLES = int(os.environ.get("INTERACTIVE_MAX_TRIPLES", "32"))
+RETRY_AFTER_SECONDS = int(os.environ.get("RETRY_AFTER_SECONDS", "1"))
+# Concurrent embedding and rerank calls per worker, handed to interactive requests first; 0 disables the gate
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "0"))
+RERANK_CONCURRENCY = int(os.environ.get("RERANK_CONCURRENCY", "0"))
+# Backends to spread rerank and embedding calls over, as comma-separated base URLs with an optional |weight
+# (http://gpu1:11434,http://gpu2:11434|2); unset means the single default URL. Endpoints that fail or answer
+# slower than ENDPOINT_SLOW_SECONDS ENDPOINT_MAX_FAILURES times in a row sit out ENDPOINT_EJECT_SECONDS
+LLM_ENDPOINTS = os.environ.get("LLM_ENDPOINTS")
+EMBEDDING_ENDPOINTS = os.environ.get("EMBEDDING_ENDPOINTS")
+ENDPOINT_MAX_FAILURES = int(os.environ.get("ENDPOINT_MAX_FAILURES", "3"))
+ENDPOINT_EJECT_SECONDS = float(os.environ.get("ENDPOINT_EJECT_SECONDS", "30"))
+ENDPOINT_SLOW_SECONDS = float(os.environ.get("ENDPOINT_SLOW_SECONDS", "0"))
+# Pool running vector search and candidate expansion (and, with "process", long rerank answer parsing) off the
+# event loop: thread, process or inline. Searches run SEARCH_CHUNK_SIZE relationships per call
+CPU_EXECUTOR = os.environ.get("CPU_EXECUTOR", "thread")
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", "4"))
+SEARCH_CHUNK_SIZE = int(os.environ.get("SEARCH_CHUNK_SIZE", "256"))
+PARSE_OFFLOAD_CHARS = int(os.environ.get("PARSE_OFFLOAD_CHARS", "2000"))
+# Byte cap of the per-worker cache of relationship embeddings; 0 disables the cache
+EMBEDDING_CACHE_BYTES = int(os.environ.get("EMBEDDING_CACHE_BYTES", str(32 * 2**20)))
+# Byte cap of the per-database cache of top-N candidates by relationship text; 0 disables the cache
+CANDIDATE_CACHE_BYTES = int(os.environ.get("CANDIDATE_CACHE_BYTES", str(16 * 2**20)))
+# Use the stored vector of a predicate text matching a relationship up to case, spacing, underscores and simple
+# inflection, instead of calling the embedding backend. Opt-in: it changes which vectors are searched
+LEXICAL_SHORTCUT = os.environ.get("LEXICAL_SHORTCUT", "false").lower() == "true"
+# Frequency-ranked relationship phrases (python -m src.warmup) looked up at startup to fill the caches; the
+# worker reports ready on /ready/ once done
+WARMUP_PHRASES = os.environ.get("WARMUP_PHRASES")
+WARMUP_LIMIT = int(os.environ.get("WARMUP_LIMIT", "1000"))
+WARMUP_CONCURRENCY = int(os.environ.get("WARMUP_CONCURRENCY", "8"))
+WARMUP_RETRIEVAL_METHODS = os.environ.get("WARMUP_RETRIEVAL_METHODS", "vectordb").split(",")
+# Update journal replayed by every worker; defaults to journal.jsonl in the snapshot directory
+PREDICATE_JOURNAL = os.environ.get("PREDICATE_JOURNAL") or (
+    str(Path(PREDICATE_SNAPSHOT_DIR) / "journal.jsonl") if PREDICATE_SNAPSHOT_DIR else None
+)
+# Token to send in the X-Admin-Token header of the endpoints that change the index; unset disables them
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+# Seconds between journal syncs and compaction checks, and the thresholds that trigger a compaction; workers
+# serving a snapshot never compact on their own
+INDEX_MAINTENANCE_INTERVAL = float(os.environ.get("INDEX_MAINTENANCE_INTERVAL", "30"))
+COMPACT_DELTA_ROWS = int(os.environ.get("COMPACT_DELTA_ROWS", "1000"))
+COMPACT_DEAD_ROWS = int(os.environ.get("COMPACT_DEAD_ROWS", "1000"))
+
+_INDEXES = {}
+# Matrix indexes the journal has been replayed into
+_REPLAYED = set()
+_DATABASES = {}
+_JSON_FILES = {}
+# Long-lived structures of this worker, reported by /admin/memory/
+MEMORY = MemoryRegistry()
+WARMUP = WarmupProgress()
 
 
 # "RENCI Relationship Extraction Pipeline"
@@ -88,49 +190,510 @@ QUALIFIED_PREDICATE_FILE = BASE_DIR.parent / "data" / "qualified_predicate_mappi
           summary="Get a standard predicate for a subject-object pair",
           description="Uses a similarity search to determine the top-n biolink predicates for each triple then re-ranks to select the best",
           tags=["Relation Extraction"],
-          response_model=QueryResponse
+          response_model=QueryResponse,
+          # "error" is only sent for triples that could not be mapped
+          response_model_exclude_none=True
           )
 async def query_predicate(
         triples: List[HEALpacaInput],
         retrieval_method: RetrievalMethod = Query(
             default=RetrievalMethod.vectordb,
             include_in_schema=False
+        ),
+        rerank_mode: RerankMode = Query(
+            default=RerankMode.text,
+            include_in_schema=False
+        ),
+        max_latency: Optional[float] = Query(
+            default=None, gt=0,
+            description=("Latency budget in seconds. Triples not reranked in time get the top vector candidate, "
+                         "with \":deadline\" appended to the selector")
+        ),
+        priority: Optional[Priority] = Query(
+            default=None,
+            description=(f"Scheduling class. Interactive requests get embedding and rerank capacity first; "
+                         f"requests over {INTERACTIVE_MAX_TRIPLES} triples are always bulk")
         )
 ):
-    try:
-        input_data = [triple.model_dump() for triple in triples]
-        if retrieval_method.value == "vectordb":
+    with admit(len(triples), priority):
+        try:
+            input_data = [triple.model_dump() for triple in triples]
             results = await run_query(input_data, QUALIFIED_PREDICATE_FILE, DESCRIPTION_FILE, EMBEDDING_FILE,
-                                      is_vdb=True, is_nn=False)
-        elif retrieval_method.value == "nearest_neighbor":
+                                      structured=rerank_mode == RerankMode.structured, max_latency=max_latency,
+                                      **retrieval_flags(retrieval_method))
+            return {"results": results}
+        except Exception as e:
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+@APP.post("/query/compact/",
+          summary="Get standard predicates for a large batch in the compact format",
+          description=("Same pipeline as /query/ for large batches. The body is "
+                       "{\"abstracts\": [...], \"triples\": [[subject, object, relationship, abstract_index], ...]} "
+                       "sent as application/json or application/msgpack, so each abstract is sent once. "
+                       "The response has the /query/ shape, as MessagePack if the Accept header asks for "
+                       "application/msgpack."),
+          tags=["Relation Extraction"],
+          response_model=QueryResponse
+          )
+async def query_predicate_compact(
+        request: Request,
+        retrieval_method: RetrievalMethod = Query(
+            default=RetrievalMethod.vectordb,
+            include_in_schema=False
+        ),
+        rerank_mode: RerankMode = Query(
+            default=RerankMode.text,
+            include_in_schema=False
+        ),
+        max_latency: Optional[float] = Query(
+            default=None, gt=0,
+            description=("Latency budget in seconds. Triples not reranked in time get the top vector candidate, "
+                         "with \":deadline\" appended to the selector")
+        ),
+        priority: Optional[Priority] = Query(
+            default=None,
+            description=(f"Scheduling class. Interactive requests get embedding and rerank capacity first; "
+                         f"requests over {INTERACTIVE_MAX_TRIPLES} triples are always bulk")
+        )
+):
+    try:
+        payload = decode_body(await request.body(), request.headers.get("content-type", ""))
+        input_data = expand_compact_triples(payload)
+    except CompactFormatError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    with admit(len(input_data), priority):
+        try:
             results = await run_query(input_data, QUALIFIED_PREDICATE_FILE, DESCRIPTION_FILE, EMBEDDING_FILE,
-                                      is_vdb=False, is_nn=True)
-        else:
-            results = await run_query(input_data, QUALIFIED_PREDICATE_FILE, DESCRIPTION_FILE, EMBEDDING_FILE)
-        return {"results": results}
+                                      structured=rerank_mode == RerankMode.structured, max_latency=max_latency,
+                                      **retrieval_flags(retrieval_method))
+        except Exception as e:
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=str(e))
+    content, media_type = encode_results(results, request.headers.get("accept", ""))
+    return Response(content=content, media_type=media_type)
+
+
+def admit(triple_count, priority):
+    """ Admit a request to this worker or answer 413, 429 or 503; use the result as a context manager. """
+    if priority is None or triple_count > INTERACTIVE_MAX_TRIPLES:
+        priority = Priority.bulk if triple_count > INTERACTIVE_MAX_TRIPLES else Priority.interactive
+    try:
+        return get_admission().admit(triple_count, priority)
+    except Overloaded as e:
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after is not None else None
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+
+
+def retrieval_flags(retrieval_method: RetrievalMethod) -> dict:
+    if retrieval_method.value == "vectordb":
+        return {"is_vdb": True, "is_nn": False}
+    if retrieval_method.value == "nearest_neighbor":
+        return {"is_vdb": False, "is_nn": True}
+    return {"is_vdb": False, "is_nn": False}
+
+
+@APP.get("/worker/memory/",
+         summary="Resident memory of the worker serving this request",
+         tags=["Operations"]
+         )
+def worker_memory():
+    usage = process_memory()
+    usage["shared_index"] = get_snapshot() is not None
+    usage["index_databases"] = len(_DATABASES)
+    return usage
+
+
+@APP.get("/snapshot/",
+         summary="Version of the predicate snapshot served by this worker",
+         tags=["Operations"]
+         )
+def snapshot_version():
+    snapshot = get_snapshot()
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="No predicate snapshot is loaded; set PREDICATE_SNAPSHOT_DIR")
+    manifest = {key: val for key, val in snapshot.manifest.items() if key != "checksums"}
+    manifest["served_version"] = served_index_version()
+    return manifest
+
+
+@APP.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    if MAX_REQUEST_BYTES and request.url.path.startswith("/query/"):
+        length = request.headers.get("content-length")
+        if length is not None and length.isdigit() and int(length) > MAX_REQUEST_BYTES:
+            get_admission().stats["too_large"] += 1
+            return ORJSONResponse(status_code=413,
+                                  content={"detail": f"Request body is over the limit of {MAX_REQUEST_BYTES} bytes"})
+    return await call_next(request)
+
+
+@APP.middleware("http")
+async def add_snapshot_header(request: Request, call_next):
+    response = await call_next(request)
+    version = served_index_version()
+    if version is not None:
+        # Lets clients and caches invalidate stored mappings when the served index changes
+        response.headers["X-Predicate-Snapshot"] = version
+    return response
+
+
+@APP.on_event("startup")
+async def load_predicate_snapshot():
+    get_snapshot()
+    asyncio.create_task(maintain_index())
+    if WARMUP_PHRASES is not None:
+        asyncio.create_task(warm_up())
+
+
+@APP.on_event("shutdown")
+async def close_client():
+    # Only a worker that built its client has batches in flight
+    if get_client.cache_info().currsize and get_client().batcher is not None:
+        await get_client().batcher.close(timeout=5)
+
+
+async def warm_up():
+    """ Build the databases and fill the embedding and candidate caches with the most frequent phrases. """
+    try:
+        phrases = read_phrases(WARMUP_PHRASES, WARMUP_LIMIT)
+        databases = {}
+        for method in WARMUP_RETRIEVAL_METHODS:
+            db = get_database(EMBEDDING_FILE, **retrieval_flags(RetrievalMethod(method.strip())))
+            await replay_journal(EMBEDDING_FILE)
+            # With a snapshot the vectordb method is served by the similarity database
+            databases[id(db)] = db
+        await warm_caches(list(databases.values()), phrases, WARMUP_CONCURRENCY, progress=WARMUP,
+                          executor=get_executor())
     except Exception as e:
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+        logging.exception("Warmup failed")
+        WARMUP.state = "failed"
+        WARMUP.error = str(e)
+
+
+@APP.get("/ready/",
+         summary="Whether this worker has finished warming up",
+         tags=["Operations"]
+         )
+def ready():
+    if WARMUP_PHRASES is None:
+        return {"ready": True, "warmup": None}
+    # A failed warmup leaves the caches cold but does not keep the worker out of rotation
+    return ORJSONResponse(status_code=200 if WARMUP.done else 503,
+                          content={"ready": WARMUP.done, "warmup": WARMUP.as_dict()})
+
+
+async def maintain_index():
+    """ Pick up updates made through other workers and compact the index in the background. """
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(INDEX_MAINTENANCE_INTERVAL)
+        for db in list(_INDEXES.values()):
+            try:
+                journal = get_journal()
+                if journal is not None:
+                    await loop.run_in_executor(None, journal.sync, db)
+                # Compacting copies the matrix into this worker's private memory, so workers sharing a mapped
+                # snapshot leave updates in the delta until the snapshot is rebuilt or /admin/compact/ is called
+                if get_snapshot() is None and db.needs_compaction(COMPACT_DELTA_ROWS, COMPACT_DEAD_ROWS):
+                    # Searches keep using the old state until the compacted one is swapped in
+                    await loop.run_in_executor(None, db.compact)
+            except Exception:
+                logging.exception("Index maintenance failed")
+
+
+@APP.get("/admin/index/",
+         summary="Size and update generation of this worker's predicate index",
+         tags=["Admin"]
+         )
+async def index_stats():
+    db = get_matrix_database(EMBEDDING_FILE)
+    await replay_journal(EMBEDDING_FILE)
+    return db.index_stats()
+
+
+@APP.get("/admin/memory/",
+         summary="Memory held by this worker's indexes, reference data and caches",
+         tags=["Admin"]
+         )
+def memory_report():
+    return {"process": process_memory(), **MEMORY.report()}
+
+
+def require_admin_token(x_admin_token: Optional[str] = Header(default=None)):
+    """ Guard for the endpoints that change the index; CORS lets any origin call the service. """
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="Index updates are disabled; set ADMIN_TOKEN to enable them")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Missing or wrong X-Admin-Token")
+
+
+# The retrieval method whose results an update must reach; the default is the /query/ default
+UPDATE_METHOD_QUERY = Query(
+    default=RetrievalMethod.vectordb,
+    description="Retrieval method the update is for; vectordb can only be updated when a snapshot is loaded"
+)
+
+
+@APP.post("/admin/predicates/",
+          summary="Add predicate entries to the index",
+          tags=["Admin"],
+          dependencies=[Depends(require_admin_token)]
+          )
+async def add_predicates(entries: List[PredicateEntry], retrieval_method: RetrievalMethod = UPDATE_METHOD_QUERY):
+    return await update_index("add", [entry.model_dump() for entry in entries], retrieval_method)
+
+
+@APP.put("/admin/predicates/",
+         summary="Replace the predicate entries with the same text",
+         tags=["Admin"],
+         dependencies=[Depends(require_admin_token)]
+         )
+async def replace_predicates(entries: List[PredicateEntry], retrieval_method: RetrievalMethod = UPDATE_METHOD_QUERY):
+    return await update_index("replace", [entry.model_dump() for entry in entries], retrieval_method)
+
+
+@APP.post("/admin/predicates/tombstone/",
+          summary="Remove predicate entries matching a predicate, a text or both",
+          tags=["Admin"],
+          dependencies=[Depends(require_admin_token)]
+          )
+async def tombstone_predicates(selectors: List[PredicateSelector], retrieval_method: RetrievalMethod = UPDATE_METHOD_QUERY):
+    return await update_index("tombstone", [selector.model_dump(exclude_none=True) for selector in selectors], retrieval_method)
+
+
+@APP.post("/admin/compact/",
+          summary="Fold added rows into the index and drop removed ones",
+          tags=["Admin"],
+          dependencies=[Depends(require_admin_token)]
+          )
+async def compact_index():
+    db = get_matrix_database(EMBEDDING_FILE)
+    await replay_journal(EMBEDDING_FILE)
+    await asyncio.get_running_loop().run_in_executor(None, db.compact)
+    return db.index_stats()
+
+
+async def update_index(op, entries, retrieval_method=RetrievalMethod.vectordb):
+    if retrieval_flags(retrieval_method)["is_vdb"] and get_snapshot() is None:
+        raise HTTPException(status_code=409, detail=(
+            "Updates only reach the similarity index. Without a snapshot (PREDICATE_SNAPSHOT_DIR) the vectordb "
+            "retrieval method keeps its own index, which would not see them; pass retrieval_method="
+            "cosine_similarities or nearest_neighbor to update the index those methods search."))
+    db = get_matrix_database(EMBEDDING_FILE)
+    await replay_journal(EMBEDDING_FILE)
+    loop = asyncio.get_running_loop()
+    try:
+        for entry in entries:
+            if op != "tombstone" and entry.get("embedding") is None:
+                entry["embedding"] = await db.client.get_embedding(entry["text"])
+                if entry["embedding"] is None:
+                    raise ValueError(f"Could not embed {entry['text']}")
+        db.validate_update(op, entries)
+        journal = get_journal()
+        if journal is None:
+            apply_update(db, op, entries)
+        else:
+            # Appending and replaying take a file lock shared with the other workers; keep them off the event loop
+            await loop.run_in_executor(None, journal.append, op, entries)
+            await loop.run_in_executor(None, journal.sync, db)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return db.index_stats()
+
+
+def lexical_shortcut_state():
+    hits, misses = blp.LEXICAL_SHORTCUT_COUNTS["hit"], blp.LEXICAL_SHORTCUT_COUNTS["miss"]
+    return {"enabled": LEXICAL_SHORTCUT, "hits": hits, "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None}
+
+
+@APP.get("/stats/",
+         summary="Counters for the pipeline stages of this worker",
+         tags=["Operations"]
+         )
+def stats():
+    client = get_client()
+    return {
+        "rerank_parse_paths": dict(blp.RERANK_PARSE_COUNTS),
+        "lexical_shortcut": lexical_shortcut_state(),
+        "embedding_batches": dict(client.batcher.stats) if client.batcher is not None else None,
+        "admission": get_admission().state(),
+        "embedding_slots": client.embedding_slots.state() if client.embedding_slots is not None else None,
+        "rerank_slots": client.rerank_slots.state() if client.rerank_slots is not None else None,
+        "cpu_executor": {"kind": get_executor().kind, **get_executor().stats},
+        "chat_endpoints": client.chat_pool.state() if client.chat_pool is not None else None,
+        "embedding_endpoints": client.embedding_pool.state() if client.embedding_pool is not None else None,
+    }
+
+
+def load_json(path):
+    """ Reference data file, read once per worker. """
+    key = str(path)
+    if key not in _JSON_FILES:
+        _JSON_FILES[key] = read_json(path)
+    return _JSON_FILES[key]
+
+
+def read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def reference_data_memory():
+    snapshot = get_snapshot()
+    data = list(_JSON_FILES.values())
+    if snapshot is not None:
+        data += [snapshot.descriptions, snapshot.qualified_predicates]
+    return {"bytes": deep_sizeof(data)}
+
+
+MEMORY.register("reference_data", reference_data_memory)
+MEMORY.register_cache(SYNC_EMBEDDING_CACHE)
+
+
+@lru_cache(maxsize=1)
+def get_client():
+    client = blp.PredicateClient(stream=STREAM_RERANK)
+    if EMBEDDING_BATCH_WINDOW_MS > 0:
+        client.enable_micro_batching(max_wait=EMBEDDING_BATCH_WINDOW_MS / 1000, max_batch_size=EMBEDDING_BATCH_SIZE)
+    client.enable_priority_gates(embedding_limit=EMBEDDING_CONCURRENCY, rerank_limit=RERANK_CONCURRENCY)
+    if LLM_ENDPOINTS or EMBEDDING_ENDPOINTS:
+        client.enable_endpoint_pools(
+            chat_endpoints=parse_endpoints(LLM_ENDPOINTS or ""),
+            embedding_endpoints=parse_endpoints(EMBEDDING_ENDPOINTS or ""),
+            max_failures=ENDPOINT_MAX_FAILURES, eject_seconds=ENDPOINT_EJECT_SECONDS, slow_seconds=ENDPOINT_SLOW_SECONDS
+        )
+    client.executor = get_executor()
+    client.parse_offload_chars = PARSE_OFFLOAD_CHARS
+    if EMBEDDING_CACHE_BYTES > 0:
+        client.enable_embedding_cache(EMBEDDING_CACHE_BYTES)
+        MEMORY.register_cache(client.embedding_cache)
+    return client
+
+
+@lru_cache(maxsize=1)
+def get_executor():
+    return CPUExecutor(kind=CPU_EXECUTOR, workers=CPU_WORKERS)
+
+
+@lru_cache(maxsize=1)
+def get_admission():
+    return AdmissionController(max_inflight_triples=MAX_INFLIGHT_TRIPLES, max_request_triples=MAX_REQUEST_TRIPLES,
+                               bulk_share=BULK_SHARE, retry_after=RETRY_AFTER_SECONDS)
+
+
+@lru_cache(maxsize=1)
+def get_snapshot():
+    if PREDICATE_SNAPSHOT_DIR is None:
+        return None
+    logging.info(f"Loading the predicate snapshot at {PREDICATE_SNAPSHOT_DIR}.... ")
+    # Checksums are verified once by main.sh before the workers start; hashing here would read the whole matrix
+    # into every worker
+    return load_snapshot(PREDICATE_SNAPSHOT_DIR, verify=False)
+
+
+@lru_cache(maxsize=1)
+def get_journal():
+    if PREDICATE_JOURNAL is None:
+        return None
+    snapshot = get_snapshot()
+    return IndexJournal(PREDICATE_JOURNAL, base_version=snapshot.version if snapshot is not None else "")
+
+
+def served_index_version():
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return None
+    records = max((db.index.journal_records for db in _INDEXES.values()), default=0)
+    return f"{snapshot.version}+{records}" if records else snapshot.version
+
+
+def get_matrix_database(embedding_file):
+    """ The worker's matrix index, shared by the similarity and nearest-neighbour databases and updated in place. """
+    key = str(embedding_file)
+    if key not in _INDEXES:
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            db = snapshot.database(get_client())
+        else:
+            db = blp.PredicateDatabase(client=get_client())
+            # Read without caching; only the index built from it is kept
+            predicate_embedding = read_json(embedding_file)
+            logging.info(f"Initializing the DB with {len(predicate_embedding)} predicate embeddings.... ")
+            db.populate_db(predicate_embedding)
+        _INDEXES[key] = db
+        MEMORY.register(f"matrix_index:{Path(key).name}", db.memory_usage)
+    return _INDEXES[key]
+
+
+async def replay_journal(embedding_file):
+    """
+    Replay the update journal into a newly built matrix index before it is first used. The replay takes a file
+    lock and applies every record, so it runs off the event loop; maintain_index keeps the index synced after.
+    """
+    key = str(embedding_file)
+    journal = get_journal()
+    if journal is None or key in _REPLAYED or key not in _INDEXES:
+        return
+    await asyncio.get_running_loop().run_in_executor(None, journal.sync, _INDEXES[key])
+    _REPLAYED.add(key)
+
+
+def get_database(embedding_file, is_vdb=False, is_nn=False):
+    """ Predicate database for this worker, built on first use and kept for the life of the process. """
+    key = (str(embedding_file), is_vdb, is_nn)
+    if key not in _DATABASES and is_vdb and get_snapshot() is not None:
+        # The vectordb backend would keep a private docarray copy per worker; the snapshot gives the same exact
+        # cosine neighbours from the shared memory-mapped matrix instead. Results report the backend used:
+        # "similarities", not "vectorDb"
+        logging.info("vectordb is served by the snapshot's similarity index")
+        _DATABASES[key] = get_database(embedding_file, is_nn=is_nn)
+    if key not in _DATABASES:
+        if is_vdb:
+            db = blp.PredicateDatabase(client=get_client(), is_vdb=True)
+            # Read without caching; only the index built from it is kept
+            predicate_embedding = read_json(embedding_file)
+            logging.info(f"Initializing the vector DB with {len(predicate_embedding)} predicate embeddings.... ")
+            db.populate_db(predicate_embedding)
+            MEMORY.register(f"vectordb_index:{Path(key[0]).name}", db.memory_usage)
+        else:
+            db = copy.copy(get_matrix_database(embedding_file))
+            db.is_nn = is_nn
+        db.lexical_shortcut = LEXICAL_SHORTCUT
+        if CANDIDATE_CACHE_BYTES > 0:
+            db.candidate_cache = ByteLRUCache(f"candidates:{blp.retrieval_selector(is_vdb, is_nn)}",
+                                              CANDIDATE_CACHE_BYTES)
+            MEMORY.register_cache(db.candidate_cache)
+        _DATABASES[key] = db
+    return _DATABASES[key]
 
 
 async def run_query(triple_input: list, qualifiedPredicate_file: str, description_file: str, embedding_file: str,
-                     is_vdb=False, is_nn=False):
-    llm = blp.PredicateClient()
-    with open(embedding_file, "r") as f:
-        predicate_embedding = json.load(f)
-    logging.info(f"Initializing the DB with {len(predicate_embedding)} predicate embeddings.... ")
-    db = blp.PredicateDatabase(client=llm, is_vdb=is_vdb, is_nn=is_nn)
-    db.populate_db(predicate_embedding)
-
-    data = blp.parse_new_llm_response(triple_input)
+                     is_vdb=False, is_nn=False, structured=False, max_latency=None):
+    # The budget covers the whole request, embedding calls included; reranking gets whatever the vector search
+    # leaves of it
+    budget = max_latency or MAX_LATENCY
+    deadline = asyncio.get_running_loop().time() + budget if budget > 0 else None
+    db = get_database(embedding_file, is_vdb=is_vdb, is_nn=is_nn)
+    await replay_journal(embedding_file)
+    llm = db.client
+
+    # Triples travel as TripleRecords and only become result dicts at the end
+    records = blp.records_from_edges(blp.parse_new_llm_response(triple_input))
     logging.info(f"Vector Searching {len(triple_input)} Data.... ")
-    relationships = await blp.lookup_unique_predicates(data, db)
+    await blp.lookup_records(records, db, executor=get_executor(), chunk_size=SEARCH_CHUNK_SIZE, deadline=deadline)
 
     logging.info(f"Reranking and Selecting top predicate choice .... ")
-    with open(description_file, "r") as f:
-        predicate_descriptions = json.load(f)
-    with open(qualifiedPredicate_file, "r") as f:
-        qualified_predicate = json.load(f)
-    relationships = blp.relationship_queries_to_batch(relationships, predicate_descriptions, db.is_vdb, db.is_nn)
-    output_triples = await llm.check_relationship(relationships, qualified_predicate, db.is_vdb, db.is_nn)
-    return output_triples
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        predicate_descriptions = snapshot.descriptions
+        qualified_predicate = snapshot.qualified_predicates
+    else:
+        predicate_descriptions = load_json(description_file)
+        qualified_predicate = load_json(qualifiedPredicate_file)
+    await llm.check_records(records, qualified_predicate, predicate_descriptions, db.is_vdb, db.is_nn,
+                            structured=structured, deadline=deadline)
+    method = blp.retrieval_method(db.is_vdb, db.is_nn)
+    return [record.as_result(method) for record in records]
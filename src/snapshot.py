@@ -0,0 +1,172 @@
+import copy
+import json
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+from datetime import datetime, timezone
+from src.predicate_database import (PredicateDatabase, INDEX_VECTORS_FILE, INDEX_PREDICATE_IDS_FILE,
+                                    INDEX_METADATA_FILE)
+from src.biolink_predicate_lookup import compute_inverses
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SCHEMA_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+REFERENCE_FILE = "reference.json"
+SNAPSHOT_FILES = [INDEX_VECTORS_FILE, INDEX_PREDICATE_IDS_FILE, INDEX_METADATA_FILE, REFERENCE_FILE]
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class Snapshot:
+    """ Everything the online path needs, loaded from one snapshot directory. """
+    def __init__(self, manifest, db, descriptions, qualified_predicates):
+        self.manifest = manifest
+        self.db = db
+        self.descriptions = descriptions
+        self.qualified_predicates = qualified_predicates
+
+    @property
+    def version(self):
+        return self.manifest["version"]
+
+    def database(self, client, is_nn=False):
+        """ A PredicateDatabase over the snapshot arrays; databases for different methods share the arrays. """
+        db = copy.copy(self.db)
+        db.client = client
+        db.is_nn = is_nn
+        return db
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_snapshot(embeddings_file, description_file, qualified_predicate_file, snapshot_dir):
+    """ Bake the predicate vectors, inverse table, descriptions and qualifier map into a versioned snapshot. """
+    snapshot_dir = Path(snapshot_dir)
+    with open(embeddings_file, "r") as f:
+        embeddings = json.load(f)
+    with open(description_file, "r") as f:
+        descriptions = json.load(f)
+    with open(qualified_predicate_file, "r") as f:
+        qualified_predicates = json.load(f)
+
+    db = PredicateDatabase(client=None)
+    db.populate_db(embeddings)
+    db.save_index(snapshot_dir, inverses=compute_inverses(db.all_pred))
+    with open(snapshot_dir / REFERENCE_FILE, "w") as f:
+        json.dump({"descriptions": descriptions, "qualified_predicates": qualified_predicates}, f)
+
+    checksums = {name: file_checksum(snapshot_dir / name) for name in SNAPSHOT_FILES}
+    sizes = {name: (snapshot_dir / name).stat().st_size for name in SNAPSHOT_FILES}
+    version = hashlib.sha256(
+        json.dumps([SNAPSHOT_SCHEMA_VERSION, checksums], sort_keys=True).encode()
+    ).hexdigest()[:16]
+    manifest = {
+        "schema_version": SNAPSHOT_SCHEMA_VERSION,
+        "version": version,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "predicate_count": len(db.all_pred),
+        "embedding_dim": int(db.all_pred_emb.shape[1]),
+        "checksums": checksums,
+        "sizes": sizes,
+        # The inputs it was built from, so a stale snapshot can be detected before the server starts
+        "sources": source_checksums(embeddings_file, description_file, qualified_predicate_file),
+    }
+    with open(snapshot_dir / MANIFEST_FILE, "w") as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(f"Wrote snapshot {version} with {len(db.all_pred)} predicate vectors to {snapshot_dir}")
+    return manifest
+
+
+def source_checksums(embeddings_file, description_file, qualified_predicate_file):
+    return {kind: file_checksum(path) for kind, path in (("embeddings", embeddings_file),
+                                                         ("descriptions", description_file),
+                                                         ("qualified_predicates", qualified_predicate_file))}
+
+
+def read_manifest(snapshot_dir):
+    with open(Path(snapshot_dir) / MANIFEST_FILE, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("schema_version") != SNAPSHOT_SCHEMA_VERSION:
+        raise SnapshotError(f"Snapshot schema version {manifest.get('schema_version')} is not supported "
+                            f"(expected {SNAPSHOT_SCHEMA_VERSION}); rebuild it with python -m src.snapshot")
+    return manifest
+
+
+def is_current(snapshot_dir, embeddings_file, description_file, qualified_predicate_file) -> bool:
+    """
+    Whether the snapshot exists, has the supported schema and was built from the current input files.
+    Inputs that are not present (an image shipping only the snapshot) cannot be compared and are accepted.
+    """
+    try:
+        manifest = read_manifest(snapshot_dir)
+    except (OSError, SnapshotError):
+        return False
+    sources = [embeddings_file, description_file, qualified_predicate_file]
+    if not all(Path(path).exists() for path in sources):
+        logger.warning(f"Input files of snapshot {manifest['version']} are missing; using it as it is")
+        return True
+    return manifest.get("sources") == source_checksums(*sources)
+
+
+def verify_snapshot(snapshot_dir):
+    """ Check the checksum of every snapshot file; reads all of them, so run it once, not in every worker. """
+    manifest = read_manifest(snapshot_dir)
+    for name, checksum in manifest["checksums"].items():
+        if file_checksum(Path(snapshot_dir) / name) != checksum:
+            raise SnapshotError(f"Checksum mismatch for {name} in snapshot {manifest['version']}")
+    return manifest
+
+
+def load_snapshot(snapshot_dir, verify=True, mmap=True) -> Snapshot:
+    """
+    Load a snapshot in one step, checking its schema version and file sizes and, if verify, its checksums.
+    Without verify no file is read in full, so the memory-mapped vectors are only paged in when searched.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    manifest = verify_snapshot(snapshot_dir) if verify else read_manifest(snapshot_dir)
+    for name, size in manifest.get("sizes", {}).items():
+        if (snapshot_dir / name).stat().st_size != size:
+            raise SnapshotError(f"Size mismatch for {name} in snapshot {manifest['version']}")
+
+    db = PredicateDatabase(client=None)
+    db.load_index(snapshot_dir, mmap=mmap)
+    with open(snapshot_dir / REFERENCE_FILE, "r") as f:
+        reference = json.load(f)
+    logger.info(f"Loaded snapshot {manifest['version']} with {manifest['predicate_count']} predicate vectors")
+    return Snapshot(manifest, db, reference["descriptions"], reference["qualified_predicates"])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build the versioned predicate snapshot loaded by the server")
+    parser.add_argument("-e", "--embeddings_file", default="data/all_biolink_mapped_vectors.json")
+    parser.add_argument("-d", "--description_file", default="data/short_description.json")
+    parser.add_argument("-q", "--qualified_predicate_file", default="data/qualified_predicate_mapping.json")
+    parser.add_argument("-o", "--snapshot_dir", default="data/predicate_snapshot")
+    parser.add_argument("--check", action="store_true",
+                        help="Exit with status 1 if the snapshot is missing or older than its input files")
+    parser.add_argument("--verify", action="store_true", help="Check the checksums of an existing snapshot")
+    args = parser.parse_args()
+    sources = (args.embeddings_file, args.description_file, args.qualified_predicate_file)
+    if args.check:
+        current = is_current(args.snapshot_dir, *sources)
+        logger.info(f"Snapshot at {args.snapshot_dir} is {'current' if current else 'missing or stale'}")
+        raise SystemExit(0 if current else 1)
+    if args.verify:
+        try:
+            logger.info(f"Verified snapshot {verify_snapshot(args.snapshot_dir)['version']}")
+        except (OSError, SnapshotError) as e:
+            logger.error(f"Snapshot verification failed: {e}")
+            raise SystemExit(1)
+        raise SystemExit(0)
+    build_snapshot(*sources, args.snapshot_dir)
@@ -0,0 +1,115 @@
+import json
+import time
+import asyncio
+import logging
+import argparse
+from collections import Counter
+from pathlib import Path
+from src.admission import PRIORITY, Priority
+from src.biolink_predicate_lookup import lookup_records
+from src.records import TripleRecord
+
+logger = logging.getLogger(__name__)
+
+
+def count_phrases(output_files) -> Counter:
+    """ Relationship frequencies in lookup_unique_predicates output files (.jsonl or .json lists of edges). """
+    counts = Counter()
+    for output_file in output_files:
+        with open(output_file, "r") as f:
+            if str(output_file).endswith(".jsonl"):
+                edges = (json.loads(line) for line in f if line.strip())
+            else:
+                edges = json.load(f)
+            counts.update(edge["relationship"] for edge in edges if edge.get("relationship"))
+    return counts
+
+
+def write_phrases(counts: Counter, phrase_file):
+    with open(phrase_file, "w") as f:
+        for phrase, count in counts.most_common():
+            f.write(f"{phrase}\t{count}\n")
+
+
+def read_phrases(phrase_file, limit=None) -> list:
+    """
+    The most frequent phrases of a ranked list: a text file with one phrase per line, optionally followed by a
+    tab and its count (as written by write_phrases), or a JSON list of phrases or object of phrase -> count.
+    """
+    path = Path(phrase_file)
+    if path.suffix == ".json":
+        with open(path, "r") as f:
+            data = json.load(f)
+        phrases = [p for p, _ in Counter(data).most_common()] if isinstance(data, dict) else data
+    else:
+        with open(path, "r") as f:
+            phrases = [line.rstrip("\n").split("\t")[0] for line in f]
+    phrases = list(dict.fromkeys(p.strip() for p in phrases if p.strip()))
+    return phrases[:limit] if limit else phrases
+
+
+class WarmupProgress:
+    def __init__(self, total=0):
+        self.state = "pending"
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    @property
+    def done(self):
+        return self.state in ("done", "failed")
+
+    def as_dict(self):
+        elapsed = None
+        if self.started is not None:
+            elapsed = round((self.finished or time.monotonic()) - self.started, 3)
+        return {"state": self.state, "total": self.total, "completed": self.completed, "failed": self.failed,
+                "elapsed_seconds": elapsed, "error": self.error}
+
+
+async def warm_caches(databases, phrases, concurrency=8, num_results=10, progress=None, executor=None):
+    """
+    Look up every phrase in every database with at most `concurrency` lookups at once, which fills the
+    embedding cache of the client and the candidate cache of each database. Runs as bulk work so live
+    interactive requests keep priority for embedding capacity.
+    """
+    progress = progress or WarmupProgress()
+    progress.total = len(phrases) * len(databases)
+    progress.state = "running"
+    progress.started = time.monotonic()
+    PRIORITY.set(Priority.bulk)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def warm(db, phrase):
+        async with semaphore:
+            try:
+                record = TripleRecord(phrase)
+                await lookup_records([record], db, num_results, executor)
+                if record.candidates is None:
+                    progress.failed += 1
+            except Exception:
+                logger.exception(f"Warmup failed for {phrase}")
+                progress.failed += 1
+            progress.completed += 1
+
+    # Phrases in frequency order, so an interrupted warmup has covered the most frequent ones
+    await asyncio.gather(*(warm(db, phrase) for phrase in phrases for db in databases))
+    progress.state = "done"
+    progress.finished = time.monotonic()
+    logger.info(f"Warmed {progress.completed} lookups ({progress.failed} failed) in "
+                f"{progress.finished - progress.started:.1f}s")
+    return progress
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Rank relationship phrases of past lookup outputs for warmup")
+    parser.add_argument("output_files", nargs="+", help="lookup_unique_predicates output files (.jsonl or .json)")
+    parser.add_argument("-o", "--phrase_file", default="data/warmup_phrases.txt")
+    args = parser.parse_args()
+    counts = count_phrases(args.output_files)
+    write_phrases(counts, args.phrase_file)
+    logger.info(f"Wrote {len(counts)} phrases to {args.phrase_file}")
@@ -0,0 +1,58 @@
+import os
+import sys
+import resource
+from pathlib import Path
+
+SMAPS_FIELDS = {
+    "Rss": "rss_bytes",
+    "Pss": "pss_bytes",
+    "Shared_Clean": "shared_clean_bytes",
+    "Shared_Dirty": "shared_dirty_bytes",
+    "Private_Clean": "private_clean_bytes",
+    "Private_Dirty": "private_dirty_bytes",
+}
+
+
+def process_memory(pid="self") -> dict:
+    """
+    Resident memory of a process. PSS splits shared pages (such as a memory-mapped index) evenly between the
+    processes mapping them, so the sum of PSS over all workers is the real footprint of the server.
+    """
+    usage = {"pid": os.getpid() if pid == "self" else int(pid)}
+    smaps = Path(f"/proc/{pid}/smaps_rollup")
+    if not smaps.exists():
+        # Not Linux: only the peak RSS of this process is available
+        usage["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return usage
+    for line in smaps.read_text().splitlines():
+        field, _, value = line.partition(":")
+        if field in SMAPS_FIELDS:
+            usage[SMAPS_FIELDS[field]] = int(value.split()[0]) * 1024
+    usage["shared_bytes"] = usage.pop("shared_clean_bytes", 0) + usage.pop("shared_dirty_bytes", 0)
+    usage["private_bytes"] = usage.pop("private_clean_bytes", 0) + usage.pop("private_dirty_bytes", 0)
+    return usage
+
+
+def child_pids(pid) -> list:
+    children = []
+    for task in Path(f"/proc/{pid}/task").iterdir():
+        children.extend(int(child) for child in (task / "children").read_text().split())
+    return children
+
+
+def print_worker_memory(master_pid):
+    """ Print the memory of every worker forked by a uvicorn master process. """
+    workers = [process_memory(pid) for pid in child_pids(master_pid)]
+    print(f"{'pid':>8} {'rss MiB':>10} {'pss MiB':>10} {'shared MiB':>11} {'private MiB':>12}")
+    for usage in workers:
+        print(f"{usage['pid']:>8} {usage['rss_bytes'] / 2**20:>10.1f} {usage['pss_bytes'] / 2**20:>10.1f} "
+              f"{usage['shared_bytes'] / 2**20:>11.1f} {usage['private_bytes'] / 2**20:>12.1f}")
+    total_pss = sum(usage["pss_bytes"] for usage in workers)
+    print(f"{len(workers)} workers, total PSS {total_pss / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python -m src.worker_memory <uvicorn master pid>")
+        sys.exit(1)
+    print_worker_memory(sys.argv[1])
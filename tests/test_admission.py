@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from src.admission import AdmissionController, Overloaded, PrioritySemaphore, Priority, PRIORITY
+
+
+def test_interactive_waiters_are_served_first():
+    order = []
+
+    async def call(semaphore, name, priority):
+        PRIORITY.set(priority)
+        async with semaphore.slot():
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        semaphore = PrioritySemaphore(1)
+        first = asyncio.create_task(call(semaphore, "first", Priority.bulk))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(call(semaphore, f"bulk {i}", Priority.bulk)) for i in range(2)]
+        await asyncio.sleep(0)
+        waiting.append(asyncio.create_task(call(semaphore, "interactive", Priority.interactive)))
+        await asyncio.gather(first, *waiting)
+        return semaphore
+
+    semaphore = asyncio.run(run())
+    assert order == ["first", "interactive", "bulk 0", "bulk 1"]
+    assert semaphore.active == 0
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def run():
+        semaphore = PrioritySemaphore(1)
+        await semaphore.acquire()
+        waiter = asyncio.create_task(semaphore.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        semaphore.release()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.wait_for(semaphore.acquire(), 1)
+        semaphore.release()
+        return semaphore
+
+    semaphore = asyncio.run(run())
+    assert semaphore.active == 0
+    assert semaphore.state()["waiting"] == 0
+
+
+def test_admission_limits():
+    controller = AdmissionController(max_inflight_triples=10, max_request_triples=8, bulk_share=0.5, retry_after=3)
+    with pytest.raises(Overloaded) as e:
+        controller.admit(9, Priority.interactive)
+    assert e.value.status_code == 413 and e.value.retry_after is None
+
+    with controller.admit(6, Priority.bulk):
+        # Nothing else was in flight, so the bulk request is admitted over its share
+        assert PRIORITY.get() == Priority.bulk
+        with pytest.raises(Overloaded) as e:
+            controller.admit(1, Priority.bulk)
+        assert e.value.status_code == 429 and e.value.retry_after == 3
+        with controller.admit(4, Priority.interactive):
+            with pytest.raises(Overloaded) as e:
+                controller.admit(1, Priority.interactive)
+            assert e.value.status_code == 503
+    assert PRIORITY.get() == Priority.interactive
+    assert controller.inflight == {Priority.interactive: 0, Priority.bulk: 0}
+    assert controller.state()["admitted"] == 2
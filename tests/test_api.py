@@ -1,10 +1,14 @@
 # export PYTHONPATH="$PYTHONPATH:$PWD"
 
 import os
+import asyncio
 import pytest
 import json
 from unittest.mock import patch
 from fastapi.testclient import TestClient
+from src import server
+from src.biolink_predicate_lookup import LOOKUP_DEADLINE_ERROR
+from src.predicate_database import PredicateDatabase
 from src.server import APP, RetrievalMethod
 client = TestClient(APP)
 
@@ -56,3 +60,149 @@ def test_query_endpoint(is_ci_env):
     assert "top_choice" in data["results"][0]
 
 
+
+
+def test_compact_query_rejects_bad_payload():
+    response = client.post("/query/compact/", content=b'{"abstracts": ["a"], "triples": [["s", "o", "r", 3]]}',
+                           headers={"content-type": "application/json"})
+    assert response.status_code == 422
+
+
+def test_oversized_request_is_refused(monkeypatch):
+    from src import server
+    from src.admission import AdmissionController
+    monkeypatch.setattr(server, "get_admission", lambda: AdmissionController(max_request_triples=1))
+    triple = {"abstract": "a", "subject": "s", "object": "o", "relationship": "r"}
+    response = client.post("/query/", json=[triple, triple])
+    assert response.status_code == 413
+
+
+def test_memory_report():
+    response = client.get("/admin/memory/")
+    assert response.status_code == 200
+    data = response.json()
+    assert "reference_data" in data["structures"]
+    assert data["caches"]["sync_embeddings"]["max_bytes"] == server.EMBEDDING_CACHE_BYTES
+    assert data["accounted_bytes"] >= 0
+
+
+def test_ready_without_warmup():
+    response = client.get("/ready/")
+    assert response.status_code == 200
+    assert response.json()["ready"] is True
+
+
+def test_updates_need_the_admin_token(monkeypatch):
+    selectors = [{"predicate": "biolink:treats"}]
+    assert client.post("/admin/predicates/tombstone/", json=selectors).status_code == 403
+    assert client.post("/admin/compact/").status_code == 403
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "secret")
+    response = client.post("/admin/predicates/tombstone/", json=selectors, headers={"X-Admin-Token": "guess"})
+    assert response.status_code == 401
+
+
+def test_updates_for_vectordb_need_a_snapshot(monkeypatch):
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "secret")
+    response = client.post("/admin/predicates/tombstone/", json=[{"predicate": "biolink:treats"}],
+                           headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 409
+    assert "snapshot" in response.json()["detail"]
+
+
+def test_query_answers_within_the_budget_when_embeddings_hang(tmp_path, monkeypatch):
+    async def get_embedding(text):
+        await asyncio.sleep(60)
+
+    async def get_chat_completion(prompt):
+        return '{"mapped_predicate": "treats", "negated": "False"}'
+
+    llm = server.get_client()
+    monkeypatch.setattr(llm, "stream", False)
+    monkeypatch.setattr(llm, "get_embedding", get_embedding)
+    monkeypatch.setattr(llm, "get_chat_completion", get_chat_completion)
+    db = PredicateDatabase(llm)
+    db.populate_db([{"predicate": "biolink:treats", "text": "treats", "embedding": [1.0] + [0.0] * 767}])
+    db.inverses = {}
+    db.lexical_shortcut = True
+    monkeypatch.setattr(server, "get_snapshot", lambda: None)
+    monkeypatch.setattr(server, "get_database", lambda *args, **kwargs: db)
+    for name in ["descriptions.json", "qualified.json"]:
+        (tmp_path / name).write_text("{}")
+
+    triples = [{"subject": "a", "object": "b", "relationship": relationship, "abstract": ""}
+               for relationship in ["treats", "improves"]]
+    query = server.run_query(triples, tmp_path / "qualified.json", tmp_path / "descriptions.json", "vectors.json",
+                             max_latency=0.2)
+    lexical, hanging = asyncio.run(asyncio.wait_for(query, timeout=10))
+
+    # The lexical match is reranked; the triple waiting on its embedding is answered without candidates
+    assert lexical["top_choice"]["predicate"] == "biolink:treats" and "error" not in lexical
+    assert hanging["error"] == LOOKUP_DEADLINE_ERROR and hanging["top_choice"] is None
+    assert hanging["relationship"] == "improves"
+
+
+def test_journal_is_replayed_off_the_event_loop(tmp_path, monkeypatch):
+    from src.index_journal import IndexJournal
+    vectors = tmp_path / "vectors.json"
+    vectors.write_text(json.dumps([{"predicate": "biolink:treats", "text": text, "embedding": [1.0] + [0.0] * 767}
+                                   for text in ["treats", "cures"]]))
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(server, "EMBEDDING_FILE", vectors)
+    monkeypatch.setattr(server, "PREDICATE_JOURNAL", str(tmp_path / "journal.jsonl"))
+    monkeypatch.setattr(server, "_INDEXES", {})
+    monkeypatch.setattr(server, "_REPLAYED", set())
+    server.get_journal.cache_clear()
+    on_loop = []
+    sync = IndexJournal.sync
+
+    def tracked_sync(self, db):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return sync(self, db)
+
+    monkeypatch.setattr(IndexJournal, "sync", tracked_sync)
+    try:
+        response = client.post("/admin/predicates/tombstone/", json=[{"text": "cures"}],
+                               params={"retrieval_method": "cosine_similarities"}, headers={"X-Admin-Token": "secret"})
+    finally:
+        server.get_journal.cache_clear()
+    assert response.status_code == 200 and response.json()["journal_records"] == 1
+    assert on_loop and not any(on_loop)
+
+
+def test_workers_sharing_a_snapshot_do_not_compact(monkeypatch):
+    class Index:
+        compactions = 0
+
+        def needs_compaction(self, delta_rows, dead_rows):
+            return True
+
+        def compact(self):
+            Index.compactions += 1
+
+    async def maintain(snapshot):
+        # The second check starts the second round, so the first one has finished
+        checks = []
+        second_round = asyncio.Event()
+
+        def get_snapshot():
+            checks.append(snapshot)
+            if len(checks) == 2:
+                second_round.set()
+            return snapshot
+
+        monkeypatch.setattr(server, "get_snapshot", get_snapshot)
+        task = asyncio.create_task(server.maintain_index())
+        await asyncio.wait_for(second_round.wait(), timeout=10)
+        task.cancel()
+
+    monkeypatch.setattr(server, "INDEX_MAINTENANCE_INTERVAL", 0.01)
+    monkeypatch.setattr(server, "get_journal", lambda: None)
+    monkeypatch.setattr(server, "_INDEXES", {"vectors.json": Index()})
+    asyncio.run(maintain(snapshot=object()))
+    assert Index.compactions == 0
+    asyncio.run(maintain(snapshot=None))
+    assert Index.compactions > 0
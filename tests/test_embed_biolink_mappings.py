@@ -0,0 +1,67 @@
+import json
+import asyncio
+import pytest
+from src.embed_biolink_mappings import collect_predicate_texts, build_vectors, EmbeddingCache
+
+
+class BatchClient:
+    embedding_model = "test-model"
+
+    def __init__(self, fail_after=None):
+        self.calls = []
+        self.fail_after = fail_after
+
+    async def get_batch_embeddings(self, texts):
+        if self.fail_after is not None and len(self.calls) >= self.fail_after:
+            return None
+        self.calls.append(list(texts))
+        return [[float(len(text))] * 4 for text in texts]
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    descriptions = tmp_path / "descriptions.json"
+    descriptions.write_text(json.dumps({"treats": "used to treat", "affects": "has an effect on"}))
+    qualified = tmp_path / "qualified.json"
+    qualified.write_text(json.dumps({"biolink:increases_abundance_of": {"predicate": "biolink:causes"}}))
+    mappings = tmp_path / "mappings.json"
+    mappings.write_text(json.dumps({"treats": ["Is A Therapy For", "treats"]}))
+    return descriptions, qualified, mappings
+
+
+def test_collect_predicate_texts(inputs):
+    entries = collect_predicate_texts(*inputs, lowercase=True)
+    assert entries == [
+        {"predicate": "biolink:treats", "text": "treats"},
+        {"predicate": "biolink:affects", "text": "affects"},
+        {"predicate": "biolink:increases_abundance_of", "text": "increases abundance of"},
+        {"predicate": "biolink:treats", "text": "is a therapy for"},
+    ]
+
+
+def test_build_vectors_batches_and_resumes(inputs, tmp_path):
+    entries = collect_predicate_texts(*inputs)
+    output = tmp_path / "vectors.json"
+    cache_file = tmp_path / "cache.jsonl"
+
+    failing = BatchClient(fail_after=1)
+    with pytest.raises(RuntimeError):
+        asyncio.run(build_vectors(failing, entries, output, cache_file, batch_size=2, concurrency=1, retries=1))
+    assert len(EmbeddingCache(cache_file, "test-model").embeddings) == 2
+
+    client = BatchClient()
+    vectors = asyncio.run(build_vectors(client, entries, output, cache_file, batch_size=2, concurrency=2))
+    assert sum(len(call) for call in client.calls) == 2
+    assert json.loads(output.read_text()) == vectors
+    assert vectors[0] == {"predicate": "biolink:treats", "text": "treats", "embedding": [6.0] * 4}
+
+    again = BatchClient()
+    asyncio.run(build_vectors(again, entries, output, cache_file))
+    assert again.calls == []
+
+
+def test_cache_ignores_other_models(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.jsonl", "model-a")
+    cache.add(["treats"], [[1.0]])
+    assert "treats" in EmbeddingCache(tmp_path / "cache.jsonl", "model-a")
+    assert "treats" not in EmbeddingCache(tmp_path / "cache.jsonl", "model-b")
@@ -0,0 +1,98 @@
+import asyncio
+from src.embedding_batcher import EmbeddingBatcher
+
+
+class Backend:
+    def __init__(self, batch_fails=False):
+        self.batches = []
+        self.singles = []
+        self.batch_fails = batch_fails
+
+    async def embed_batch(self, texts):
+        self.batches.append(list(texts))
+        await asyncio.sleep(0)
+        return None if self.batch_fails else [[float(len(t))] for t in texts]
+
+    async def embed_one(self, text):
+        self.singles.append(text)
+        return [float(len(text))]
+
+
+def test_concurrent_callers_share_one_batch():
+    backend = Backend()
+
+    async def run():
+        batcher = EmbeddingBatcher(backend.embed_batch, backend.embed_one, max_wait=0.01)
+        return await asyncio.gather(*(batcher.embed(text) for text in ["a", "bb", "a", "ccc"]))
+
+    assert asyncio.run(run()) == [[1.0], [2.0], [1.0], [3.0]]
+    assert backend.batches == [["a", "bb", "ccc"]]
+
+
+def test_size_limit_flushes_without_waiting():
+    backend = Backend()
+
+    async def run():
+        batcher = EmbeddingBatcher(backend.embed_batch, backend.embed_one, max_wait=10, max_batch_size=2)
+        return await asyncio.wait_for(asyncio.gather(*(batcher.embed(t) for t in ["a", "b", "c", "d"])), 1)
+
+    assert len(asyncio.run(run())) == 4
+    assert backend.batches == [["a", "b"], ["c", "d"]]
+
+
+def test_failed_batch_falls_back_to_single_calls():
+    backend = Backend(batch_fails=True)
+
+    async def run():
+        batcher = EmbeddingBatcher(backend.embed_batch, backend.embed_one, max_wait=0.001)
+        results = await asyncio.gather(batcher.embed("a"), batcher.embed("bb"))
+        return results, batcher.stats
+
+    results, stats = asyncio.run(run())
+    assert results == [[1.0], [2.0]]
+    assert backend.singles == ["a", "bb"]
+    assert stats["fallbacks"] == 1
+
+
+def test_cancelled_caller_does_not_cancel_others():
+    backend = Backend()
+
+    async def run():
+        batcher = EmbeddingBatcher(backend.embed_batch, backend.embed_one, max_wait=0.01)
+        first = asyncio.create_task(batcher.embed("a"))
+        second = asyncio.create_task(batcher.embed("a"))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == [1.0]
+
+
+def test_close_sends_waiting_texts_and_keeps_flushes_referenced():
+    backend = Backend()
+
+    async def run():
+        batcher = EmbeddingBatcher(backend.embed_batch, backend.embed_one, max_wait=10)
+        waiting = asyncio.ensure_future(batcher.embed("a"))
+        await asyncio.sleep(0)
+        await batcher.close()
+        assert not batcher.tasks
+        return await waiting
+
+    assert asyncio.run(run()) == [1.0]
+    assert backend.batches == [["a"]]
+
+
+def test_callers_of_a_cancelled_batch_do_not_hang():
+    async def hanging_batch(texts):
+        await asyncio.sleep(60)
+
+    async def run():
+        batcher = EmbeddingBatcher(hanging_batch, None, max_wait=0)
+        waiting = asyncio.ensure_future(batcher.embed("a"))
+        await asyncio.sleep(0.01)
+        await batcher.close(timeout=0)
+        await asyncio.wait_for(asyncio.wait([waiting]), timeout=10)
+        return waiting.cancelled()
+
+    assert asyncio.run(run())
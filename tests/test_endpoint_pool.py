@@ -0,0 +1,60 @@
+import json
+import asyncio
+import httpx
+from src import llm_client
+from src.llm_client import HEALpacaAsyncClient
+from src.endpoint_pool import EndpointPool, parse_endpoints
+
+
+def test_parse_endpoints():
+    assert parse_endpoints("http://a:11434/, http://b:11434|2") == [("http://a:11434", 1.0), ("http://b:11434", 2.0)]
+
+
+def test_least_outstanding_per_weight():
+    pool = EndpointPool([("http://a", 1.0), ("http://b", 2.0)])
+    picked = []
+    for _ in range(3):
+        endpoint = pool.pick()
+        endpoint.outstanding += 1
+        picked.append(endpoint.base_url)
+    assert sorted(picked) == ["http://a", "http://b", "http://b"]
+
+
+def test_failing_endpoint_is_ejected_and_readmitted():
+    pool = EndpointPool([("http://a", 1.0), ("http://b", 1.0)], max_failures=2, eject_seconds=0.05)
+    bad = pool.endpoints[0]
+    for _ in range(2):
+        pool.record(bad, 0.01, error="ConnectError")
+    assert {pool.pick().base_url for _ in range(4)} == {"http://b"}
+    assert pool.state()[0]["ejected"] and pool.state()[0]["errors"] == 2
+
+    asyncio.run(asyncio.sleep(0.06))
+    assert "http://a" in {pool.pick().base_url for _ in range(4)}
+    # On probation: one more failure ejects it again, for twice as long
+    pool.record(bad, 0.01, error="ConnectError")
+    assert bad.ejections == 2
+    pool.endpoints[1].ejected_until = 0
+    assert {pool.pick().base_url for _ in range(4)} == {"http://b"}
+
+
+def test_client_fails_over_to_a_healthy_endpoint(monkeypatch):
+    def handler(request):
+        if request.url.host == "down":
+            raise httpx.ConnectError("refused")
+        assert request.url.path == "/api/generate"
+        return httpx.Response(200, json={"response": '{"mapped_predicate": "treats"}'})
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(llm_client.httpx, "AsyncClient",
+                        lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs))
+    client = HEALpacaAsyncClient()
+    client.enable_endpoint_pools(chat_endpoints=[("http://down:11434", 1.0), ("http://up:11434", 1.0)],
+                                 max_failures=1)
+
+    async def run():
+        return [await client.get_chat_completion("prompt") for _ in range(4)]
+
+    assert all(json.loads(answer) == {"mapped_predicate": "treats"} for answer in asyncio.run(run()))
+    down, up = client.chat_pool.state()
+    assert down["errors"] == 1 and down["ejected"]
+    assert up["requests"] == 4 and up["outstanding"] == 0
@@ -0,0 +1,48 @@
+import json
+import numpy as np
+from src.evaluate_retrieval import (load_examples, evaluate_backends, fastest_meeting, candidate_name,
+                                    BACKENDS)
+from src.biolink_predicate_lookup import rank_candidates
+
+
+def unit(i, noise=0.0, seed=0):
+    vector = np.zeros(768)
+    vector[i] = 1.0
+    vector += noise * np.random.default_rng(seed).standard_normal(768)
+    return vector.tolist()
+
+
+PREDICATES = ["biolink:treats", "biolink:causes", "biolink:affects", "biolink:prevents"]
+EMBEDDINGS = [{"predicate": p, "text": p.split(":")[1], "embedding": unit(i)} for i, p in enumerate(PREDICATES)]
+
+
+def test_expansion_adds_inverses():
+    db = type("Db", (), {"inverses": {"treats": "treated_by"}})()
+    results = {0: {"mapped_predicate": "biolink:treats_NEG", "score": 0.9},
+               1: {"mapped_predicate": "biolink:affects", "score": 0.5}}
+    assert rank_candidates(results, db) == [("treats", 0.9), ("treated by", 0.9), ("affects", 0.5)]
+
+
+def test_evaluate_backends(tmp_path):
+    labeled = tmp_path / "labeled.jsonl"
+    records = [
+        {"relationship": "is a therapy for", "predicate": "biolink:treats", "embedding": unit(0, 0.01, 1)},
+        {"relationship": "leads to", "predicate": ["biolink:causes", "biolink:affects"], "embedding": unit(1, 0.01, 2)},
+        # The inverse of the nearest predicate is accepted
+        {"relationship": "is treated by", "predicate": "biolink:treated_by", "embedding": unit(0, 0.01, 3)},
+        {"relationship": "stops", "predicate": "biolink:prevents", "embedding": unit(2, 0.01, 4)},
+    ]
+    labeled.write_text("".join(json.dumps(record) + "\n" for record in records))
+    examples = load_examples(labeled)
+    assert examples[1]["gold"] == {"causes", "affects"}
+
+    rows = evaluate_backends(EMBEDDINGS, examples, backends=list(BACKENDS), ks=(1, 2, 4), num_results=4,
+                             inverses={"treats": "treated_by"})
+    assert [row["backend"] for row in rows] == list(BACKENDS)
+    for row in rows:
+        assert row["recall@1"] == 0.5
+        assert row["recall@4"] == 1.0
+        assert row["p95_ms"] >= row["p50_ms"] > 0
+    assert fastest_meeting(rows, 4, 0.9) is not None
+    assert fastest_meeting(rows, 1, 0.9) is None
+    assert candidate_name("biolink:treated_by") == "treated by"
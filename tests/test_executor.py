@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+from src.biolink_predicate_lookup import lookup_unique_predicates
+from src.executor import CPUExecutor, chunks
+from src.predicate_database import PredicateDatabase
+
+ROWS = 20000
+BATCH = 256
+
+
+@pytest.fixture(scope="module")
+def database():
+    rng = np.random.default_rng(0)
+    db = PredicateDatabase(client=None)
+    db.populate_db([{"predicate": f"biolink:p{i % 300}", "text": f"text {i}", "embedding": vector}
+                    for i, vector in enumerate(rng.standard_normal((ROWS, 768), dtype=np.float32))])
+    db.inverses = {}
+    return db
+
+
+def make_batch():
+    rng = np.random.default_rng(1)
+    return [{"relationship": f"relationship {i}", "relationship_embedding": vector}
+            for i, vector in enumerate(rng.standard_normal((BATCH, 768), dtype=np.float32))]
+
+
+def test_chunked_search_matches_single_search(database):
+    edges = make_batch()[:50]
+    expected = [asyncio.run(database.search(e["relationship"], e["relationship_embedding"]))
+                for e in edges]
+    batch = database.search_batch([e["relationship"] for e in edges], [e["relationship_embedding"] for e in edges])
+    for results, single in zip(batch, expected):
+        # Matrix-matrix and matrix-vector products may differ in the last bits
+        assert list(results) == list(single)
+        assert [r["score"] for r in results.values()] == pytest.approx([r["score"] for r in single.values()], abs=1e-5)
+    assert chunks(list(range(5)), 2) == [[0, 1], [2, 3], [4]]
+
+
+def test_event_loop_runs_while_a_search_blocks(database, monkeypatch):
+    """ Each search waits for a callback it schedules on the event loop, which only runs while the loop is free. """
+    search_batch = database.search_batch
+    for kind, timeout in (("thread", 10), ("inline", 0.05)):
+        executor = CPUExecutor(kind=kind, workers=2)
+        loop_ran = []
+
+        async def run():
+            loop = asyncio.get_running_loop()
+
+            def waiting_search(texts, embeddings, num_results):
+                released = threading.Event()
+                loop.call_soon_threadsafe(released.set)
+                loop_ran.append(released.wait(timeout))
+                return search_batch(texts, embeddings, num_results)
+
+            monkeypatch.setattr(database, "search_batch", waiting_search)
+            return await lookup_unique_predicates(make_batch(), database, executor=executor, chunk_size=64)
+
+        edges = asyncio.run(run())
+        executor.shutdown()
+        assert all(edge["Top_n_candidates"] for edge in edges)
+        # Offloaded, the loop runs callbacks during every search; inline it is blocked until the search returns
+        assert loop_ran == [kind == "thread"] * 4
+
+
+def test_long_answers_are_parsed_on_the_executor():
+    from src.biolink_predicate_lookup import PredicateClient
+    client = PredicateClient()
+    client.executor = CPUExecutor(kind="thread", workers=1)
+    client.parse_offload_chars = 100
+
+    async def chat(prompt):
+        return "Reasoning... " * 20 + '{"mapped_predicate": "treats", "negated": "False"}'
+
+    client.get_chat_completion = chat
+    relationship = {"subject": "a", "object": "b", "relationship": "r", "abstract": "",
+                    "predicate_choices": {"affects": "has an effect on", "treats": "used to treat"}}
+    result, = asyncio.run(client.check_relationship([relationship], {}))
+    client.executor.shutdown()
+    assert result["top_choice"]["predicate"] == "biolink:treats"
+    assert client.executor.stats["offloaded"] == 1
@@ -0,0 +1,53 @@
+import copy
+import pytest
+from src.predicate_database import PredicateDatabase
+from src.index_journal import IndexJournal
+
+EMBEDDINGS = [
+    {"predicate": "P1", "text": "Text about relationship", "embedding": [0.1] * 768},
+    {"predicate": "P2", "text": "RE is cool", "embedding": [0.6] * 768},
+]
+
+
+def make_db():
+    db = PredicateDatabase(client=None)
+    db.populate_db(EMBEDDINGS)
+    return db
+
+
+def test_journal_reaches_every_worker(tmp_path):
+    journal_path = tmp_path / "journal.jsonl"
+    worker_a, worker_b = make_db(), make_db()
+    journal_a, journal_b = IndexJournal(journal_path, "v1"), IndexJournal(journal_path, "v1")
+
+    journal_a.append("add", [{"predicate": "P3", "text": "added", "embedding": [0.3] * 768}])
+    journal_a.append("tombstone", [{"predicate": "P1"}])
+    assert journal_a.sync(worker_a) == 2
+    assert journal_a.sync(worker_a) == 0
+
+    assert journal_b.sync(worker_b) == 2
+    for db in (worker_a, worker_b):
+        assert db.index_stats()["live_rows"] == 2
+        assert db.index.journal_records == 2
+
+
+def test_journal_skips_other_snapshots(tmp_path):
+    journal_path = tmp_path / "journal.jsonl"
+    IndexJournal(journal_path, "old").append("tombstone", [{"predicate": "P1"}])
+    db = make_db()
+    assert IndexJournal(journal_path, "new").sync(db) == 0
+    assert db.index_stats()["live_rows"] == 2
+
+
+def test_copies_share_updates(tmp_path):
+    db = make_db()
+    nn_db = copy.copy(db)
+    nn_db.is_nn = True
+    IndexJournal(tmp_path / "journal.jsonl").append("add", [{"predicate": "P3", "text": "x", "embedding": [0.3] * 768}])
+    IndexJournal(tmp_path / "journal.jsonl").sync(db)
+    assert nn_db.all_pred == ["P1", "P2", "P3"]
+
+
+def test_unknown_operation(tmp_path):
+    with pytest.raises(ValueError):
+        IndexJournal(tmp_path / "journal.jsonl").append("drop", [])
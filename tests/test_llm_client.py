@@ -0,0 +1,95 @@
+import json
+import asyncio
+import httpx
+from src import llm_client
+from src.llm_client import HEALpacaAsyncClient, JsonObjectScanner
+
+
+def test_scanner_finds_answer_across_chunks():
+    scanner = JsonObjectScanner("mapped_predicate")
+    chunks = ['Answer: {"mapped_', 'predicate": "tre', 'ats {x}", "negated": ', '"False"}', " and more"]
+    results = [scanner.feed(chunk) for chunk in chunks]
+    assert results[:3] == [None, None, None]
+    assert json.loads(results[3]) == {"mapped_predicate": "treats {x}", "negated": "False"}
+
+
+def test_scanner_skips_objects_without_required_key():
+    scanner = JsonObjectScanner("mapped_predicate")
+    assert scanner.feed('{"note": "thinking"} then ') is None
+    assert scanner.feed('{"mapped_predicate": "none", "negated": "False"}') == '{"mapped_predicate": "none", "negated": "False"}'
+
+
+def test_scanner_needs_the_key_not_its_mention():
+    scanner = JsonObjectScanner("mapped_predicate")
+    assert scanner.feed('{"reasoning": "the mapped_predicate should be treats"} ') is None
+    assert scanner.feed("{'mapped_predicate': 'treats'}") == "{'mapped_predicate': 'treats'}"
+
+
+def mock_stream(monkeypatch, lines, sent=None):
+    async def body():
+        for line in lines:
+            if sent is not None:
+                sent.append(line)
+            yield (line + "\n").encode()
+
+    def handler(request):
+        assert json.loads(request.content)["stream"] is True
+        return httpx.Response(200, content=body())
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(llm_client.httpx, "AsyncClient",
+                        lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs))
+
+
+def test_streamed_completion_skips_malformed_lines(monkeypatch):
+    tokens = ['{"mapped_predicate": ', '"treats", "negated": "False"}']
+    lines = [json.dumps({"response": tokens[0], "done": False}), '{"response": "trunc',
+             json.dumps({"response": tokens[1], "done": False}), json.dumps({"response": "", "done": True})]
+    mock_stream(monkeypatch, lines)
+    client = HEALpacaAsyncClient(api_url="http://llm/api/generate", stream=True)
+    answer = asyncio.run(client.get_streamed_chat_completion("prompt", stop_key="mapped_predicate"))
+    assert json.loads(answer) == {"mapped_predicate": "treats", "negated": "False"}
+
+
+def test_streamed_completion_stops_early(monkeypatch):
+    tokens = ['{"mapped_predicate"', ': "treats", ', '"negated": "False"}', " Explanation", " follows", "."]
+    lines = [json.dumps({"response": token, "done": False}) for token in tokens]
+    sent = []
+    mock_stream(monkeypatch, lines + [json.dumps({"response": "", "done": True})], sent)
+
+    client = HEALpacaAsyncClient(api_url="http://llm/api/generate", stream=True)
+    answer = asyncio.run(client.get_streamed_chat_completion("prompt", stop_key="mapped_predicate"))
+    assert json.loads(answer) == {"mapped_predicate": "treats", "negated": "False"}
+    assert len(sent) < len(tokens)
+
+
+def test_batch_embeddings(monkeypatch):
+    def handler(request):
+        texts = json.loads(request.content)["input"]
+        return httpx.Response(200, json={"embeddings": [[float(i)] * 3 for i, _ in enumerate(texts)]})
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(llm_client.httpx, "AsyncClient",
+                        lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs))
+    client = HEALpacaAsyncClient(embedding_batch_url="http://llm/api/embed")
+    assert asyncio.run(client.get_batch_embeddings(["a", "b"])) == [[0.0] * 3, [1.0] * 3]
+
+
+def test_embedding_cache_skips_repeated_calls():
+    client = HEALpacaAsyncClient()
+    client.enable_embedding_cache(max_bytes=2**20)
+    calls = []
+
+    async def embed(text):
+        calls.append(text)
+        return [0.5] * 768 if text != "broken" else None
+
+    client._get_single_embedding = embed
+
+    async def run():
+        return [await client.get_embedding(text) for text in ["treats", "treats", "broken", "broken"]]
+
+    results = asyncio.run(run())
+    assert results[0] is results[1]
+    assert calls == ["treats", "broken", "broken"]
+    assert client.embedding_cache.state()["hits"] == 1
@@ -1,5 +1,7 @@
+import asyncio
 import pytest
-from src.biolink_predicate_lookup import extract_mapped_predicate
+from src.biolink_predicate_lookup import (extract_mapped_predicate, build_choice_index, parse_structured_response,
+                                          rerank_schema, PredicateClient)
 
 
 def test_extract_valid_json_mapping():
@@ -7,3 +9,62 @@ def test_extract_valid_json_mapping():
     choices = {"treats": "used to treat", "prevents": "used to prevent"}
     result = extract_mapped_predicate(response, choices)
     assert result.get("mapped_predicate", None) == "biolink:treats"
+
+
+def test_structured_response_fast_path():
+    choices = {"treats": "used to treat", "treated by": "is treated with"}
+    index = build_choice_index(choices)
+    result = parse_structured_response('{"mapped_predicate": "Treated_By", "negated": "True"}', index)
+    assert result == {"mapped_predicate": "biolink:treated_by", "negated": "True"}
+
+    result = parse_structured_response('{"mapped_predicate": "used to treat", "negated": "False"}', index)
+    assert result["mapped_predicate"] == "biolink:treats"
+
+    result = parse_structured_response('{"mapped_predicate": "none", "negated": "False"}', index)
+    assert result == {"mapped_predicate": None, "negated": "False"}
+
+
+def test_structured_response_falls_back():
+    index = build_choice_index({"treats": "used to treat"})
+    assert parse_structured_response('Sure! {"mapped_predicate": "treats", "negated": false}', index) is None
+    assert parse_structured_response('{"mapped_predicate": "prevents", "negated": "False"}', index) is None
+    assert parse_structured_response(None, index) is None
+
+
+def test_rerank_schema_restricts_choices():
+    schema = rerank_schema({"treats": "used to treat", "prevents": "used to prevent"})
+    assert schema["properties"]["mapped_predicate"]["enum"] == ["treats", "prevents", "none"]
+    assert set(schema["required"]) == {"mapped_predicate", "negated"}
+
+
+def test_deadline_returns_vector_selection_for_slow_reranks():
+    client = PredicateClient()
+    cancelled = []
+
+    async def chat(prompt):
+        if "slow" not in prompt:
+            return '{"mapped_predicate": "treats", "negated": "False"}'
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(prompt)
+            raise
+
+    client.get_chat_completion = chat
+    relationships = [
+        {"subject": "a", "object": "b", "relationship": relationship, "abstract": "",
+         "predicate_choices": {"affects": "has an effect on", "treats": "used to treat"}}
+        for relationship in ["fast", "slow"]
+    ]
+
+    async def run():
+        deadline = asyncio.get_running_loop().time() + 0.1
+        return await client.check_relationship(relationships, {}, is_nn=True, deadline=deadline)
+
+    fast, slow = asyncio.run(run())
+    assert fast["top_choice"]["predicate"] == "biolink:treats"
+    assert fast["top_choice"]["selector"] == client.chat_model
+    assert slow["top_choice"]["predicate"] == "biolink:affects"
+    assert slow["top_choice"]["selector"] == "nearest_neighbors:deadline"
+    assert "predicate_choices" not in slow
+    assert len(cancelled) == 1
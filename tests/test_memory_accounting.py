@@ -0,0 +1,60 @@
+import numpy as np
+from src.memory_accounting import ByteLRUCache, MemoryRegistry, deep_sizeof
+from src.predicate_database import PredicateDatabase
+
+EMBEDDINGS = [
+    {"predicate": f"P{i}", "text": f"text {i}", "embedding": [float(i + 1)] * 768}
+    for i in range(4)
+]
+
+
+def test_cache_evicts_to_stay_under_its_byte_cap():
+    embedding_bytes = deep_sizeof([0.5] * 768)
+    cache = ByteLRUCache("embeddings", max_bytes=int(2.5 * embedding_bytes))
+    for text in ["a", "b"]:
+        cache.put(text, [0.5] * 768)
+    assert cache.get("a") is not None
+    cache.put("c", [0.5] * 768)
+
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.bytes <= cache.max_bytes
+    assert cache.state()["evictions"] == 1
+    cache.put("huge", [0.5] * 768 * 3)
+    assert "huge" not in cache
+
+
+def test_arrays_count_their_buffer_once():
+    array = np.zeros(1000, np.float32)
+    header = deep_sizeof(array[:0])
+    assert deep_sizeof(array) == 4000 + header
+    assert deep_sizeof(array[10:]) == header
+
+
+def test_memory_usage_separates_mapped_rows(tmp_path):
+    db = PredicateDatabase(client=None)
+    db.populate_db(EMBEDDINGS)
+    private = db.memory_usage()
+    assert private["shared_bytes"] == 0
+    assert private["matrix_bytes"] == 4 * 768 * 4
+    assert private["bytes"] > private["matrix_bytes"]
+
+    db.save_index(tmp_path)
+    mapped = PredicateDatabase(client=None)
+    mapped.load_index(tmp_path)
+    usage = mapped.memory_usage()
+    assert usage["shared_bytes"] >= usage["matrix_bytes"]
+    assert usage["bytes"] < usage["matrix_bytes"]
+    assert deep_sizeof(mapped.index.state.embeddings) < 1024
+
+
+def test_registry_report():
+    registry = MemoryRegistry()
+    cache = ByteLRUCache("embeddings", max_bytes=10000)
+    cache.put("a", [0.5] * 10)
+    registry.register("index", lambda: {"bytes": 100, "shared_bytes": 50})
+    registry.register_cache(cache)
+    report = registry.report()
+    assert report["accounted_bytes"] == 100 + cache.bytes
+    assert report["shared_bytes"] == 50
+    assert report["cache_limit_bytes"] == 10000
+    assert report["caches"]["embeddings"]["entries"] == 1
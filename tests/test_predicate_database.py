@@ -1,8 +1,9 @@
 import pytest
 import torch
 import asyncio
+import numpy as np
 from unittest.mock import AsyncMock, MagicMock
-from src.predicate_database import PredicateDatabase, transform_embedding
+from src.predicate_database import PredicateDatabase, transform_embedding, lexical_key
 
 EMBEDDINGS = [
     {"predicate": "P1", "text": "Text about relationship", "embedding": [0.1] * 768},
@@ -86,3 +87,153 @@ def test_search_performance(dummy_client):
 
     print(f"\nSearch took: {duration:.6f} seconds")
     assert duration < 1.0
+
+
+def test_save_and_load_index(dummy_client, tmp_path):
+    db = PredicateDatabase(dummy_client)
+    db.populate_db(EMBEDDINGS)
+    db.save_index(tmp_path, inverses={"P1": "P2"})
+
+    shared = PredicateDatabase(dummy_client)
+    shared.load_index(tmp_path)
+    assert isinstance(shared.all_pred_emb, np.memmap)
+    assert shared.all_pred == db.all_pred
+    assert shared.inverses == {"P1": "P2"}
+
+    query = transform_embedding([0.3] * 768)
+    expected = asyncio.run(db.search("query", embedding=query, num_results=3))
+    result = asyncio.run(shared.search("query", embedding=query, num_results=3))
+    assert [v["mapped_predicate"] for v in result.values()] == [v["mapped_predicate"] for v in expected.values()]
+
+
+def test_vdb_index_not_shareable(dummy_client, tmp_path):
+    db = PredicateDatabase(dummy_client, is_vdb=True)
+    with pytest.raises(ValueError):
+        db.load_index(tmp_path)
+
+
+def test_incremental_updates(dummy_client):
+    db = PredicateDatabase(dummy_client)
+    db.populate_db(EMBEDDINGS)
+    query = transform_embedding([0.9] + [0.0] * 767)
+
+    db.add_entries([{"predicate": "P4", "text": "new phrasing", "embedding": [1.0] + [0.0] * 767}])
+    result = asyncio.run(db.search("query", embedding=query, num_results=1))
+    assert [v["mapped_predicate"] for v in result.values()] == ["P4"]
+    assert "P4" in db.predicate_table
+    assert db.index_stats()["delta_rows"] == 1
+
+    assert db.replace_entries([{"predicate": "P5", "text": "new phrasing", "embedding": [1.0] + [0.0] * 767}]) == 1
+    result = asyncio.run(db.search("query", embedding=query, num_results=1))
+    assert [v["mapped_predicate"] for v in result.values()] == ["P5"]
+
+    assert db.tombstone_entries([{"predicate": "P5"}]) == 1
+    result = asyncio.run(db.search("query", embedding=query, num_results=10))
+    assert "P5" not in [v["mapped_predicate"] for v in result.values()]
+    assert len(result) == 3
+
+
+def test_search_keeps_its_state_during_update(dummy_client):
+    db = PredicateDatabase(dummy_client)
+    db.populate_db(EMBEDDINGS)
+    state = db.index.state
+    db.tombstone_entries([{"text": "RE is cool"}])
+    assert state.live is None
+    assert db.index.state is not state
+    assert db.index_stats()["live_rows"] == 2
+
+
+def test_compact(dummy_client):
+    db = PredicateDatabase(dummy_client)
+    db.populate_db(EMBEDDINGS)
+    db.add_entries([{"predicate": "P4", "text": "new phrasing", "embedding": [1.0] + [0.0] * 767}])
+    db.tombstone_entries([{"predicate": "P1"}])
+    assert db.needs_compaction(max_delta_rows=0)
+
+    assert db.compact() == 3
+    assert db.all_pred == ["P2", "P3", "P4"]
+    assert db.index_stats()["delta_rows"] == 0
+    assert not db.needs_compaction(max_delta_rows=0, max_dead_rows=0)
+
+    db.is_nn = True
+    result = asyncio.run(db.search("query", embedding=transform_embedding([1.0] + [0.0] * 767), num_results=1))
+    assert [v["mapped_predicate"] for v in result.values()] == ["P4"]
+
+
+def test_tombstone_mask_matches_a_row_scan(dummy_client):
+    db = PredicateDatabase(dummy_client)
+    db.populate_db([{"predicate": f"P{i % 7}", "text": f"text {i % 50}", "embedding": [1.0] * 768} for i in range(300)])
+    selectors = [{"predicate": "P3"}, {"text": "text 4"}, {"predicate": "P1", "text": "text 8"},
+                 {"predicate": "P9"}, {"text": "missing"}]
+    state = db.index.state
+    expected = np.array([
+        not any(s.get("predicate", state.predicates[row]) == state.predicates[row] and
+                s.get("text", state.texts[row]) == state.texts[row] for s in selectors)
+        for row in range(state.rows)
+    ])
+    assert db.tombstone_entries(selectors) == int((~expected).sum())
+    assert np.array_equal(db.index.state.live, expected)
+
+
+def test_updates_not_supported_on_vdb(dummy_client):
+    db = PredicateDatabase(dummy_client, is_vdb=True)
+    with pytest.raises(ValueError):
+        db.add_entries([{"predicate": "P4", "text": "new phrasing", "embedding": [1.0] * 768}])
+
+
+def test_validate_update(dummy_client):
+    db = PredicateDatabase(dummy_client)
+    db.populate_db(EMBEDDINGS)
+    db.validate_update("add", [{"predicate": "P4", "text": "x", "embedding": [1.0] * 768}])
+    with pytest.raises(ValueError):
+        db.validate_update("add", [{"predicate": "P4", "text": "x", "embedding": [1.0] * 3}])
+    with pytest.raises(ValueError):
+        db.validate_update("tombstone", [{}])
+
+
+def test_lexical_key():
+    assert lexical_key("Increased_Expression  of") == lexical_key("increases expression of")
+    assert lexical_key("biolink:treats") == lexical_key("treated") == lexical_key("Treating")
+    assert lexical_key("treated by") != lexical_key("treats")
+
+
+def test_lexical_vector_follows_updates(dummy_client):
+    db = PredicateDatabase(dummy_client)
+    db.populate_db(EMBEDDINGS)
+    assert np.allclose(db.lexical_vector("re_is  COOL"), np.full(768, 1 / np.sqrt(768)))
+    assert db.lexical_vector("unknown phrasing") is None
+
+    db.add_entries([{"predicate": "P4", "text": "new phrasings", "embedding": [1.0] + [0.0] * 767}])
+    assert db.lexical_vector("New phrasing")[0] == pytest.approx(1.0)
+    db.tombstone_entries([{"predicate": "P4"}])
+    assert db.lexical_vector("New phrasing") is None
+    db.compact()
+    assert db.lexical_vector("new phrasing") is None
+    assert db.lexical_vector("RE is cool") is not None
+
+
+def test_lexical_vector_vdb(dummy_client):
+    db = PredicateDatabase(dummy_client, is_vdb=True)
+    db.populate_db(EMBEDDINGS)
+    # Built on first use, from the indexed documents
+    assert db.memory_usage()["lexicon_bytes"] == 0
+    assert np.allclose(db.lexical_vector("litcoin textual relates"), np.full(768, 1 / np.sqrt(768)))
+    assert db.memory_usage()["lexicon_bytes"] > 0
+
+
+def test_lexical_shortcut_skips_embedding(dummy_client):
+    from src.biolink_predicate_lookup import process_single_edge, LEXICAL_SHORTCUT_COUNTS
+    db = PredicateDatabase(dummy_client)
+    db.populate_db(EMBEDDINGS)
+    db.add_entries([{"predicate": "P4", "text": "new phrasing", "embedding": [1.0] + [0.0] * 767}])
+    db.inverses = {}
+    db.lexical_shortcut = True
+    hits = LEXICAL_SHORTCUT_COUNTS["hit"]
+
+    edge = asyncio.run(process_single_edge({"relationship": "New_phrasings"}, db, num_results=1))
+    assert list(edge["Top_n_candidates"]) == ["P4"]
+    assert LEXICAL_SHORTCUT_COUNTS["hit"] == hits + 1
+    dummy_client.get_embedding.assert_not_called()
+
+    asyncio.run(process_single_edge({"relationship": "something else"}, db, num_results=1))
+    dummy_client.get_embedding.assert_called_once()
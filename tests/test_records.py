@@ -0,0 +1,149 @@
+import asyncio
+import numpy as np
+from src.biolink_predicate_lookup import (EMBEDDING_ERROR, LOOKUP_DEADLINE_ERROR, PredicateClient, lookup_records,
+                                         process_edges, process_single_edge, rank_candidates, records_from_edges)
+from src.memory_accounting import ByteLRUCache, deep_sizeof
+from src.predicate_database import PredicateDatabase
+from src.records import CANDIDATE_NAMES, Candidates, TripleRecord
+
+EMBEDDINGS = [
+    {"predicate": "biolink:treats", "text": "treats", "embedding": [1.0] + [0.0] * 767},
+    {"predicate": "biolink:causes", "text": "causes", "embedding": [0.0, 1.0] + [0.0] * 766},
+    {"predicate": "biolink:affects", "text": "affects", "embedding": [0.0, 0.0, 1.0] + [0.0] * 765},
+]
+
+
+class Client:
+    def __init__(self):
+        self.calls = []
+
+    async def get_embedding(self, text):
+        self.calls.append(text)
+        return [0.8, 0.6] + [0.0] * 766
+
+
+def make_database():
+    db = PredicateDatabase(Client())
+    db.populate_db(EMBEDDINGS)
+    db.inverses = {"treats": "treated_by"}
+    db.candidate_cache = ByteLRUCache("candidates", 2**20)
+    return db
+
+
+def test_candidates_round_trip_scores():
+    ranked = [("treats", 0.91234), ("treated by", 0.91234), ("causes", -0.1)]
+    candidates = Candidates.from_ranked(ranked)
+    assert candidates.ids.dtype == np.int32 and candidates.scores.dtype == np.float32
+    assert candidates.as_dict() == dict(ranked)
+    assert candidates.as_response() == {0: {"mapped_predicate": "treats", "score": 0.91234},
+                                        1: {"mapped_predicate": "treated by", "score": 0.91234},
+                                        2: {"mapped_predicate": "causes", "score": -0.1}}
+    assert CANDIDATE_NAMES.id_of("treats") == candidates.ids[0]
+
+
+def test_records_share_one_embedding_block():
+    db = make_database()
+    records = [TripleRecord(relationship, "a", "b", "abstract") for relationship in ["improves", "leads to"]]
+    block = asyncio.run(lookup_records(records, db, num_results=2))
+
+    assert block.shape == (2, 768) and block.dtype == np.float32
+    assert [record.row for record in records] == [0, 1]
+    assert records[0].candidate_names() == ["treats", "treated by", "causes"]
+    assert not hasattr(records[0], "__dict__")
+
+    # Cached candidates are the same arrays, without an embedding call
+    cached = TripleRecord("improves")
+    asyncio.run(lookup_records([cached], db, num_results=2))
+    assert cached.candidates is records[0].candidates and cached.row == -1
+    assert db.client.calls == ["improves", "leads to"]
+    assert db.candidate_cache.bytes >= deep_sizeof(cached.candidates) > cached.candidates.ids.nbytes
+
+
+def test_edge_dicts_match_records():
+    db = make_database()
+    edge = asyncio.run(process_single_edge({"relationship": "improves"}, db, 2))
+    results = db.search_batch(["improves"], [edge["relationship_embedding"]], 2)
+    assert edge["Top_n_candidates"] == dict(rank_candidates(results[0], db))
+    assert len(edge["relationship_embedding"]) == 768
+
+
+def test_check_records_builds_the_result_at_the_end():
+    db = make_database()
+    record = TripleRecord("improves", "aspirin", "pain", "")
+    asyncio.run(lookup_records([record], db, num_results=2))
+    client = PredicateClient()
+
+    async def chat(prompt):
+        assert "used to treat" in prompt
+        return '{"mapped_predicate": "treats", "negated": "False"}'
+
+    client.get_chat_completion = chat
+    asyncio.run(client.check_records([record], {}, {"treats": "used to treat"}, is_nn=True))
+    result = record.as_result("nearest_neighbors")
+    assert result["top_choice"]["predicate"] == "biolink:treats"
+    assert result["Top_n_candidates"][2] == {"mapped_predicate": "causes", "score": 0.6}
+    assert result["Top_n_retrieval_method"] == "nearest_neighbors"
+
+
+def test_bad_triples_keep_their_place():
+    db = make_database()
+    edges = [{"subject": "a", "object": "b"}, {"relationship": "improves"}]
+    records = records_from_edges(edges)
+    asyncio.run(lookup_records(records, db, num_results=2))
+    unembedded = TripleRecord("no embedding")
+    client = PredicateClient()
+
+    async def chat(prompt):
+        return '{"mapped_predicate": "treats", "negated": "False"}'
+
+    client.get_chat_completion = chat
+    asyncio.run(client.check_records(records + [unembedded], {}, {}))
+
+    first, second, third = [record.as_result("similarities") for record in records + [unembedded]]
+    assert first["error"] == "Missing 'relationship'" and first["top_choice"] is None
+    assert "error" not in second and second["top_choice"]["predicate"] == "biolink:treats"
+    assert third["error"] == "No predicate candidates for the relationship" and third["top_choice"] is None
+    assert asyncio.run(process_edges(edges, db, 2)) == edges and "Top_n_candidates" not in edges[0]
+
+
+def test_lookup_stops_waiting_on_embeddings_at_the_deadline():
+    db = make_database()
+    asyncio.run(lookup_records([TripleRecord("improves")], db, num_results=2))
+    embed = db.client.get_embedding
+    cancelled = []
+
+    async def get_embedding(text):
+        if text == "slow":
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append(text)
+                raise
+        return await embed(text)
+
+    db.client.get_embedding = get_embedding
+    records = [TripleRecord(relationship) for relationship in ["improves", "slow", "leads to"]]
+
+    async def lookup():
+        deadline = asyncio.get_running_loop().time() + 0.2
+        await asyncio.wait_for(lookup_records(records, db, num_results=2, deadline=deadline), timeout=10)
+
+    asyncio.run(lookup())
+    cached, slow, fast = records
+    assert cached.candidates is not None and fast.candidates is not None and cancelled == ["slow"]
+    assert slow.candidates is None and slow.as_result("similarities")["error"] == LOOKUP_DEADLINE_ERROR
+
+
+def test_failed_embeddings_are_not_deadline_misses():
+    db = make_database()
+    embed = db.client.get_embedding
+
+    async def get_embedding(text):
+        return None if text == "broken" else await embed(text)
+
+    db.client.get_embedding = get_embedding
+    for deadline in [None, float("inf")]:
+        records = [TripleRecord("broken"), TripleRecord("improves")]
+        asyncio.run(lookup_records(records, db, num_results=2, deadline=deadline))
+        assert records[0].error == EMBEDDING_ERROR and records[0].candidates is None
+        assert records[1].error is None and records[1].candidates is not None
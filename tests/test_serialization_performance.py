@@ -0,0 +1,87 @@
+import json
+import time
+import msgpack
+import orjson
+from src.server import HEALpacaInput, QueryResponse
+from src.serialization import (compact_triples, decode_body, expand_compact_triples, encode_results,
+                               JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE)
+
+NUM_TRIPLES = 10000
+TRIPLES_PER_ABSTRACT = 5
+
+
+def make_triples():
+    abstract = ("Oral administration of betaine significantly reduced the level of cardiac marker enzyme in the serum "
+                "and prevented left ventricular remodeling. ") * 8
+    return [
+        {"abstract": f"{i // TRIPLES_PER_ABSTRACT} {abstract}", "subject": f"Subject {i}", "object": f"Object {i}",
+         "relationship": "increases expression of"}
+        for i in range(NUM_TRIPLES)
+    ]
+
+
+def make_results(triples):
+    return [
+        {**triple,
+         "top_choice": {"predicate": "biolink:affects", "object_aspect_qualifier": "expression",
+                        "object_direction_qualifier": "increased", "negated": False, "selector": "HEALpaca-2.0"},
+         "Top_n_candidates": {k: {"mapped_predicate": f"predicate {k}", "score": 0.8 - k / 100} for k in range(10)},
+         "Top_n_retrieval_method": "similarities"}
+        for triple in triples
+    ]
+
+
+def cpu_per_triple(fn):
+    start = time.process_time()
+    fn()
+    return (time.process_time() - start) / NUM_TRIPLES * 1e6
+
+
+def test_serialization_formats():
+    triples = make_triples()
+    results = make_results(triples)
+
+    json_request = json.dumps(triples).encode()
+    compact_json_request = orjson.dumps(compact_triples(triples))
+    compact_msgpack_request = msgpack.packb(compact_triples(triples))
+
+    def pydantic_path():
+        inputs = [HEALpacaInput(**triple).model_dump() for triple in json.loads(json_request)]
+        assert len(inputs) == NUM_TRIPLES
+        response = QueryResponse(results=results)
+        return response.model_dump_json().encode()
+
+    def compact_path(body, content_type, accept):
+        def run():
+            inputs = expand_compact_triples(decode_body(body, content_type))
+            assert len(inputs) == NUM_TRIPLES
+            return encode_results(results, accept)[0]
+        return run
+
+    formats = {
+        "json + pydantic": (json_request, pydantic_path),
+        "compact json": (compact_json_request, compact_path(compact_json_request, JSON_MEDIA_TYPE, JSON_MEDIA_TYPE)),
+        "compact msgpack": (compact_msgpack_request,
+                            compact_path(compact_msgpack_request, MSGPACK_MEDIA_TYPE, MSGPACK_MEDIA_TYPE)),
+    }
+
+    print(f"\n{NUM_TRIPLES} triples, {TRIPLES_PER_ABSTRACT} per abstract")
+    print(f"{'format':<18} {'request bytes':>14} {'response bytes':>15} {'CPU us/triple':>14}")
+    measured = {}
+    for name, (request, path) in formats.items():
+        response = path()
+        measured[name] = (len(request), len(response), cpu_per_triple(path))
+        print(f"{name:<18} {measured[name][0]:>14} {measured[name][1]:>15} {measured[name][2]:>14.2f}")
+
+    assert measured["compact json"][0] < measured["json + pydantic"][0] / 3
+    assert measured["compact msgpack"][0] <= measured["compact json"][0]
+    assert measured["compact msgpack"][1] < measured["json + pydantic"][1]
+
+
+def test_compact_round_trip():
+    triples = make_triples()[:12]
+    payload = compact_triples(triples)
+    assert len(payload["abstracts"]) == 3
+    expanded = expand_compact_triples(decode_body(msgpack.packb(payload), MSGPACK_MEDIA_TYPE))
+    assert expanded == triples
+    assert expanded[0]["abstract"] is expanded[1]["abstract"]
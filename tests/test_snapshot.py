@@ -0,0 +1,117 @@
+import json
+import pytest
+import numpy as np
+from src import snapshot
+from src.snapshot import build_snapshot, is_current, load_snapshot, SnapshotError, MANIFEST_FILE
+
+EMBEDDINGS = [
+    {"predicate": "biolink:treats", "text": "treats", "embedding": [0.1] * 768},
+    {"predicate": "biolink:treated_by", "text": "treated by", "embedding": [0.6] * 768},
+    {"predicate": "biolink:treats", "text": "cures", "embedding": [0.3] * 767 + [0.9]},
+]
+
+
+@pytest.fixture
+def snapshot_inputs(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "compute_inverses", lambda predicates: {"treats": "treated by"})
+    files = {
+        "embeddings": (tmp_path / "vectors.json", EMBEDDINGS),
+        "descriptions": (tmp_path / "descriptions.json", {"treats": "used to treat"}),
+        "qualified": (tmp_path / "qualified.json", {"biolink:increases_activity_of": {"predicate": "biolink:affects"}}),
+    }
+    for path, content in files.values():
+        path.write_text(json.dumps(content))
+    return [path for path, _ in files.values()] + [tmp_path / "snapshot"]
+
+
+def test_build_and_load_snapshot(snapshot_inputs):
+    manifest = build_snapshot(*snapshot_inputs)
+    loaded = load_snapshot(snapshot_inputs[-1])
+
+    assert loaded.version == manifest["version"]
+    assert manifest["predicate_count"] == 3
+    assert loaded.db.predicate_table == ["biolink:treated_by", "biolink:treats"]
+    assert loaded.db.all_pred == ["biolink:treats", "biolink:treated_by", "biolink:treats"]
+    assert isinstance(loaded.db.all_pred_emb, np.memmap)
+    assert loaded.db.inverses == {"treats": "treated by"}
+    assert loaded.descriptions == {"treats": "used to treat"}
+    assert "biolink:increases_activity_of" in loaded.qualified_predicates
+
+    db = loaded.database(client=None, is_nn=True)
+    assert db.is_nn and not loaded.db.is_nn
+    assert db.all_pred_emb is loaded.db.all_pred_emb
+
+
+def test_snapshot_version_is_content_addressed(snapshot_inputs):
+    first = build_snapshot(*snapshot_inputs)
+    second = build_snapshot(*snapshot_inputs)
+    assert first["version"] == second["version"]
+
+
+def test_snapshot_checksum_mismatch(snapshot_inputs):
+    build_snapshot(*snapshot_inputs)
+    snapshot_dir = snapshot_inputs[-1]
+    (snapshot_dir / "reference.json").write_text(json.dumps({"descriptions": {}, "qualified_predicates": {}}))
+    with pytest.raises(SnapshotError):
+        load_snapshot(snapshot_dir)
+
+
+def test_workers_load_without_hashing(snapshot_inputs, monkeypatch):
+    build_snapshot(*snapshot_inputs)
+    snapshot_dir = snapshot_inputs[-1]
+    monkeypatch.setattr(snapshot, "file_checksum", lambda path: pytest.fail(f"hashed {path}"))
+    assert load_snapshot(snapshot_dir, verify=False).db.predicate_table == ["biolink:treated_by", "biolink:treats"]
+
+    # A truncated file is still caught from the sizes in the manifest
+    (snapshot_dir / "reference.json").write_text("{}")
+    with pytest.raises(SnapshotError):
+        load_snapshot(snapshot_dir, verify=False)
+
+
+def test_snapshot_is_stale_when_its_inputs_change(snapshot_inputs):
+    assert not is_current(snapshot_inputs[-1], *snapshot_inputs[:-1])
+    build_snapshot(*snapshot_inputs)
+    assert is_current(snapshot_inputs[-1], *snapshot_inputs[:-1])
+
+    snapshot_inputs[1].write_text(json.dumps({"treats": "used to cure"}))
+    assert not is_current(snapshot_inputs[-1], *snapshot_inputs[:-1])
+    build_snapshot(*snapshot_inputs)
+    assert is_current(snapshot_inputs[-1], *snapshot_inputs[:-1])
+
+    # Without its inputs the snapshot cannot be compared and is used as it is
+    snapshot_inputs[0].unlink()
+    assert is_current(snapshot_inputs[-1], *snapshot_inputs[:-1])
+
+
+def test_snapshot_schema_version_mismatch(snapshot_inputs):
+    build_snapshot(*snapshot_inputs)
+    manifest_path = snapshot_inputs[-1] / MANIFEST_FILE
+    manifest = json.loads(manifest_path.read_text())
+    manifest["schema_version"] = 0
+    manifest_path.write_text(json.dumps(manifest))
+    with pytest.raises(SnapshotError):
+        load_snapshot(snapshot_inputs[-1])
+
+
+def test_server_reports_the_backend_used_for_vectordb(snapshot_inputs, monkeypatch, caplog):
+    from src import server
+    from src.biolink_predicate_lookup import retrieval_method, retrieval_selector
+    build_snapshot(*snapshot_inputs)
+    monkeypatch.setattr(server, "PREDICATE_SNAPSHOT_DIR", str(snapshot_inputs[-1]))
+    monkeypatch.setattr(server, "PREDICATE_JOURNAL", None)
+    monkeypatch.setattr(server, "_INDEXES", {})
+    monkeypatch.setattr(server, "_DATABASES", {})
+    server.get_snapshot.cache_clear()
+    server.get_journal.cache_clear()
+    try:
+        with caplog.at_level("INFO"):
+            db = server.get_database(snapshot_inputs[0], is_vdb=True)
+            assert server.get_database(snapshot_inputs[0], is_vdb=True) is db
+        assert caplog.text.count("vectordb is served by the snapshot") == 1
+        assert server.get_database(snapshot_inputs[0]) is db and not db.is_vdb
+        assert retrieval_method(db.is_vdb, db.is_nn) == "similarities"
+        assert retrieval_selector(db.is_vdb, db.is_nn) == "similarities"
+    finally:
+        server.get_snapshot.cache_clear()
+        server.get_journal.cache_clear()
+
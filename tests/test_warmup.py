@@ -0,0 +1,64 @@
+import json
+import asyncio
+from src.biolink_predicate_lookup import process_single_edge
+from src.llm_client import HEALpacaAsyncClient
+from src.memory_accounting import ByteLRUCache
+from src.predicate_database import PredicateDatabase
+from src.warmup import count_phrases, write_phrases, read_phrases, warm_caches, WarmupProgress
+
+EMBEDDINGS = [
+    {"predicate": "biolink:treats", "text": "treats", "embedding": [1.0] + [0.0] * 767},
+    {"predicate": "biolink:causes", "text": "causes", "embedding": [0.0, 1.0] + [0.0] * 766},
+]
+
+
+def make_database(calls):
+    client = HEALpacaAsyncClient()
+    client.enable_embedding_cache(2**20)
+
+    async def embed(text):
+        calls.append(text)
+        return [1.0, 0.5] + [0.0] * 766
+
+    client._get_single_embedding = embed
+    db = PredicateDatabase(client)
+    db.populate_db(EMBEDDINGS)
+    db.inverses = {}
+    db.candidate_cache = ByteLRUCache("candidates", 2**20)
+    return db
+
+
+def test_phrase_ranking(tmp_path):
+    outputs = tmp_path / "lookup.jsonl"
+    outputs.write_text("".join(json.dumps({"relationship": r}) + "\n" for r in ["treats", "inhibits", "treats"]))
+    write_phrases(count_phrases([outputs]), tmp_path / "phrases.txt")
+    assert read_phrases(tmp_path / "phrases.txt") == ["treats", "inhibits"]
+    assert read_phrases(tmp_path / "phrases.txt", limit=1) == ["treats"]
+
+    (tmp_path / "phrases.json").write_text(json.dumps({"inhibits": 2, "treats": 5}))
+    assert read_phrases(tmp_path / "phrases.json") == ["treats", "inhibits"]
+
+
+def test_warmup_fills_the_caches():
+    calls = []
+    db = make_database(calls)
+    progress = WarmupProgress()
+
+    async def run():
+        await warm_caches([db], ["treats", "inhibits"], concurrency=2, progress=progress)
+        return await process_single_edge({"relationship": "treats"}, db, 10)
+
+    edge = asyncio.run(run())
+    assert progress.as_dict()["state"] == "done" and progress.completed == 2 and progress.failed == 0
+    assert calls == ["treats", "inhibits"]
+    assert list(edge["Top_n_candidates"]) == ["treats", "causes"]
+    assert db.candidate_cache.state()["hits"] == 1
+
+
+def test_index_updates_bypass_cached_candidates():
+    calls = []
+    db = make_database(calls)
+    asyncio.run(process_single_edge({"relationship": "treats"}, db, 10))
+    db.tombstone_entries([{"predicate": "biolink:treats"}])
+    edge = asyncio.run(process_single_edge({"relationship": "treats"}, db, 10))
+    assert list(edge["Top_n_candidates"]) == ["causes"]
@@ -0,0 +1,13 @@
+import os
+import sys
+import pytest
+from src.worker_memory import process_memory
+
+
+def test_process_memory_self():
+    usage = process_memory()
+    assert usage["pid"] == os.getpid()
+    if sys.platform.startswith("linux"):
+        assert usage["rss_bytes"] > 0
+        assert usage["pss_bytes"] <= usage["rss_bytes"]
+        assert usage["shared_bytes"] + usage["private_bytes"] == pytest.approx(usage["rss_bytes"], rel=0.01)